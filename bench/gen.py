@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Synthetic stylesheets for benchmarking
+
+	gen.py SIZE [options] > sheet.css
+
+Writes about SIZE bytes (e.g. 1K, 64K, 50M) of CSS shaped like real
+sites' sheets: rules of one or more selectors over tags, classes, ids
+and pseudo-classes; declarations drawn from a shared pool so the same
+ones recur across rules (what refactoring feeds on); runs of
+shorthand children such as margin-top...margin-left that can be merged;
+and the comment and property hacks found in the wild. The same seed
+and options always give the same sheet.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import sys
+from random import Random
+from optparse import OptionParser
+
+TAGS = ('a', 'body', 'div', 'form', 'h1', 'h2', 'h3', 'img', 'input', 'li',
+	'p', 'span', 'table', 'td', 'ul')
+PSEUDO = ('hover', 'active', 'visited', 'focus', 'first-child')
+WORDS = ('nav', 'menu', 'item', 'header', 'footer', 'content', 'sidebar',
+	'box', 'title', 'link', 'button', 'logo', 'search', 'main', 'wrap',
+	'inner', 'list', 'odd', 'even', 'active', 'selected', 'clear')
+COLORS = ('black', 'white', 'red', 'gray', 'navy', 'Yellow', 'transparent')
+FONTS = ('Arial', 'Helvetica', 'Georgia', 'Verdana', 'sans-serif', 'serif')
+
+# each shorthand's children, which refactoring merges into it
+SHORTHANDS = (
+	('margin', ('margin-top', 'margin-right', 'margin-bottom', 'margin-left')),
+	('padding', ('padding-top', 'padding-right', 'padding-bottom', 'padding-left')),
+	('border-width', ('border-top-width', 'border-right-width',
+		'border-bottom-width', 'border-left-width')),
+	('font', ('font-size', 'line-height', 'font-family')),
+)
+
+# the hacks of test/format, as (before the rule, property prefix, after)
+HACKS = (
+	('/*\\*//*/ ', '', ' /**/'),	# IE5/Mac only
+	('', '*', ''),			# IE7 and earlier
+	('', '_', ''),			# IE6 and earlier
+)
+
+class Generator:
+	"""
+	sels: most selectors in a rule; dup: chance a declaration is one
+	seen before; shorthand: chance a rule gets a run of shorthand
+	children; hacks: chance a rule uses a hack
+	"""
+	def __init__(self, seed=1, sels=3, dup=0.6, shorthand=0.2, hacks=0.02):
+		self.rnd = Random(seed)
+		self.sels = sels
+		self.dup = dup
+		self.shorthand = shorthand
+		self.hacks = hacks
+		self.pool = []
+	def length(self):
+		r = self.rnd
+		n = r.choice((0, 0, 1, 1, 2, 5, 10, 12, 20, 100))
+		if n == 0:
+			return '0'
+		return '%u%s' % (n, r.choice(('px', 'px', 'px', 'em', '%', 'pt')))
+	def color(self):
+		r = self.rnd
+		if r.random() < 0.5:
+			return r.choice(COLORS)
+		return '#%06x' % r.choice((0, 0xffffff, 0xcccccc, 0x336699, r.getrandbits(24)))
+	def value(self, prop):
+		r = self.rnd
+		if prop.endswith('color') or prop == 'color':
+			return self.color()
+		if prop == 'font-family':
+			return ', '.join(r.sample(FONTS, r.randint(1, 3)))
+		if prop == 'line-height':
+			return r.choice(('1', '1.2', '1.5em', '18px', 'normal'))
+		if prop in ('display', 'float', 'text-align', 'position', 'font-weight'):
+			return r.choice({
+				'display': ('block', 'inline', 'none', 'inline-block'),
+				'float': ('left', 'right', 'none'),
+				'text-align': ('left', 'center', 'right'),
+				'position': ('relative', 'absolute', 'static'),
+				'font-weight': ('bold', 'normal'),
+			}[prop])
+		if prop == 'background':
+			return '%s url(img/%s.png) no-repeat' % (self.color(), r.choice(WORDS))
+		if prop == 'border':
+			return '%s solid %s' % (self.length(), self.color())
+		return self.length()
+	def decl(self):
+		r = self.rnd
+		if self.pool and r.random() < self.dup:
+			return r.choice(self.pool)
+		prop = r.choice(('color', 'background-color', 'background', 'border',
+			'width', 'height', 'display', 'float', 'text-align', 'position',
+			'font-weight', 'top', 'left', 'font-size', 'line-height'))
+		d = '%s: %s' % (prop, self.value(prop))
+		self.pool.append(d)
+		return d
+	def selector(self):
+		r = self.rnd
+		parts = []
+		for _ in xrange(r.choice((1, 1, 2, 2, 3))):
+			kind = r.random()
+			if kind < 0.3:
+				s = r.choice(TAGS)
+			elif kind < 0.8:
+				s = r.choice(('', r.choice(TAGS))) + '.' + '-'.join(
+					r.sample(WORDS, r.randint(1, 2)))
+			else:
+				s = '#' + r.choice(WORDS) + str(r.randint(1, 50))
+			if r.random() < 0.1:
+				s += ':' + r.choice(PSEUDO)
+			parts.append(s)
+		return ' '.join(parts)
+	def rule(self):
+		r = self.rnd
+		sels = ', '.join(self.selector()
+			for _ in xrange(r.randint(1, self.sels)))
+		decls = []
+		props = set()
+		for _ in xrange(r.randint(1, 6)):
+			d = self.decl()
+			# a property once per rule, as people mostly write them
+			prop = d.split(':')[0]
+			if prop not in props:
+				props.add(prop)
+				decls.append(d)
+		if r.random() < self.shorthand:
+			_, children = r.choice(SHORTHANDS)
+			for c in children[:r.randint(2, len(children))]:
+				decls.append('%s: %s' % (c, self.value(c)))
+		before, prefix, after = '', '', ''
+		if r.random() < self.hacks:
+			before, prefix, after = r.choice(HACKS)
+			if prefix:
+				decls[-1] = prefix + decls[-1]
+		if r.random() < 0.05:
+			before = '/* %s */\n' % ' '.join(r.sample(WORDS, 3)) + before
+		return '%s%s {\n\t%s;\n}%s\n' % (before, sels,
+			';\n\t'.join(decls), after)
+	def sheet(self, size):
+		"""about size bytes of rules"""
+		out = []
+		n = 0
+		while n < size:
+			s = self.rule()
+			out.append(s)
+			n += len(s)
+		return ''.join(out)
+
+def parse_size(s):
+	"""'64K' and the like as a number of bytes"""
+	s = s.strip().upper()
+	for suffix, n in (('K', 1 << 10), ('M', 1 << 20), ('G', 1 << 30)):
+		if s.endswith(suffix):
+			return int(float(s[:-1]) * n)
+	return int(s)
+
+def add_options(op):
+	"""Generator's options, for gen.py and macro.py"""
+	op.add_option('--seed', dest='seed', type='int', default=1, help='random seed (default %default)')
+	op.add_option('--sels', dest='sels', type='int', default=3, metavar='N', help='at most N selectors per rule (default %default)')
+	op.add_option('--dup', dest='dup', type='float', default=0.6, metavar='P', help='chance a declaration repeats an earlier one (default %default)')
+	op.add_option('--shorthand', dest='shorthand', type='float', default=0.2, metavar='P', help='chance a rule has a run of shorthand children (default %default)')
+	op.add_option('--hacks', dest='hacks', type='float', default=0.02, metavar='P', help='chance a rule uses a comment or property hack (default %default)')
+
+def generator(opts):
+	return Generator(opts.seed, opts.sels, opts.dup, opts.shorthand, opts.hacks)
+
+if __name__ == '__main__':
+	op = OptionParser(usage='%prog [options] SIZE')
+	add_options(op)
+	(Opts, Args) = op.parse_args()
+	if len(Args) != 1:
+		op.error('give a SIZE, such as 64K')
+	sys.stdout.write(generator(Opts).sheet(parse_size(Args[0])))
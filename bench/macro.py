@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+End to end benchmarks over generated stylesheets
+
+	macro.py run [options] > results.json
+	macro.py compare BASELINE.json RESULTS.json
+
+run times each stage of the pipeline on a gen.py sheet of each size:
+CSSDoc.parse(), doc.format() canonical and minified, CSSRefactor()
+and aggressive(), the best of --repeat runs of each. Where Linux lets
+the peak resident size be reset, it also records memory: how far each
+stage took the peak over what was resident as it began (the worst of
+the runs; memory an earlier stage freed and this one reused doesn't
+show) and the peak of all of them, each size in a fresh process.
+compare prints each stage's time, and memory per megabyte of input,
+against a baseline run's and exits 1 if any got slower, or bigger, by
+more than --threshold, so scaling can be checked before and after a
+change. aggressive() is compared by its time per step, since
+--aggressive-max may stop it, and flagged if it stopped for another
+reason than the baseline's.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import os
+import sys
+import json
+import platform
+import subprocess
+from time import time, strftime
+from optparse import OptionParser
+
+Here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(Here, '..', 'src'))
+
+import gen
+import memory
+import parse as cssparse
+import refactor as cssrefactor
+
+SIZES = '1K,16K,256K,1M'
+
+# what run() times, in order
+STAGES = ('parse', 'format_canonical', 'format_minify', 'refactor',
+	'aggressive')
+
+def timed(f):
+	"""
+	(seconds f() took, bytes it took the peak resident size over what
+	was resident before, what it returned); the bytes are None where
+	the peak can't be reset and read
+	"""
+	before = memory.status()
+	reset = memory.reset_peak()
+	start = time()
+	x = f()
+	t = time() - start
+	after = memory.status()
+	if reset and before and after and None not in before + after:
+		return t, max(0, after[1] - before[0]), x
+	return t, None, x
+
+def bench(text, repeat=1, aggressive_max=None, aggressive_size=None):
+	"""the best of repeat timings of each of STAGES on text; aggressive
+	stops after aggressive_max seconds, and is left out for text longer
+	than aggressive_size"""
+	best = {}
+	mem = {}
+	def keep(stage, (seconds, grew, x)):
+		best[stage] = min(best.get(stage, seconds), seconds)
+		if grew is not None:
+			mem[stage] = max(mem.get(stage, grew), grew)
+		return x
+	for _ in xrange(repeat):
+		doc = keep('parse', timed(lambda: cssparse.CSSDoc.parse(text, lean=True)))
+		# a fresh doc for each, so neither sees the other's format cache
+		keep('format_canonical', timed(lambda: doc.format(cssparse.CANONICAL)))
+		doc = cssparse.CSSDoc.parse(text, lean=True)
+		keep('format_minify', timed(lambda: doc.format(cssparse.MINIFY)))
+		doc = cssparse.CSSDoc.parse(text, lean=True)
+		ref = keep('refactor', timed(lambda: cssrefactor.CSSRefactor(doc)))
+		if aggressive_size is None or len(text) <= aggressive_size:
+			steps = [0]
+			def aggressive():
+				for steps[0] in ref.aggressive(yield_step=True,
+						time_max=aggressive_max):
+					pass
+			keep('aggressive', timed(aggressive))
+			best['aggressive_steps'] = steps[0]
+			best['aggressive_stopped'] = ref.stopped
+	best['rules'] = len(doc.rules)
+	if mem:
+		best['memory'] = mem
+	return best
+
+def revision():
+	"""the git commit benchmarked, if known"""
+	try:
+		p = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'],
+			cwd=Here, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		return p.communicate()[0].strip() or None
+	except OSError:
+		return None
+
+def isolated(f):
+	"""f() in a forked process, so one size's leftovers don't count
+	against the next; f returns what json can carry"""
+	rd, wr = os.pipe()
+	pid = os.fork()
+	if not pid:
+		os.close(rd)
+		status = 1
+		try:
+			out = os.fdopen(wr, 'w')
+			out.write(json.dumps(f()))
+			out.close()
+			status = 0
+		finally:
+			os._exit(status)
+	os.close(wr)
+	f = os.fdopen(rd)
+	out = f.read()
+	f.close()
+	if os.waitpid(pid, 0)[1]:
+		raise Exception('benchmark process failed')
+	return json.loads(out)
+
+def run(opts, log=sys.stderr):
+	results = []
+	for size in opts.sizes.split(','):
+		def one():
+			text = gen.generator(opts).sheet(gen.parse_size(size))
+			log.write('%6s %9u bytes... ' % (size, len(text)))
+			_, peak, r = timed(lambda: bench(text, opts.repeat, opts.aggressive_max,
+				gen.parse_size(opts.aggressive_size) if opts.aggressive_size else None))
+			if peak is not None:
+				r.setdefault('memory', {})['peak'] = peak
+			r['bytes'] = len(text)
+			return r
+		r = isolated(one)
+		r['size'] = size
+		mem = r.get('memory', {})
+		print >> log, ' '.join('%s %.3fs%s' % (s, r[s], ' %.1fMB' % (mem[s] / 1048576.0)
+			if s in mem else '') for s in STAGES if s in r) + \
+			(' peak %.1fMB' % (mem['peak'] / 1048576.0) if 'peak' in mem else '')
+		results.append(r)
+	return {
+		'meta': {
+			'date': strftime('%Y-%m-%d %H:%M:%S'),
+			'revision': revision(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'generator': dict((k, getattr(opts, k)) for k in
+				('seed', 'sels', 'dup', 'shorthand', 'hacks')),
+			'repeat': opts.repeat,
+			'aggressive_max': opts.aggressive_max,
+		},
+		'results': results,
+	}
+
+def per_mb(r, stage):
+	"""stage's memory in r per byte of input, i.e. MB per input MB"""
+	m = r.get('memory', {}).get(stage)
+	return m / float(r['bytes']) if m is not None else None
+
+def step_count(r):
+	"""aggressive()'s steps in r, at least 1 so time can be divided by it"""
+	return max(1, r.get('aggressive_steps') or 0)
+
+def compare(base, new, threshold=0.1, noise=0.005, mem_noise=1 << 20,
+		out=sys.stdout):
+	"""
+	print each stage's time and memory per input megabyte in new against
+	base, and the peak of them all, flagging those more than threshold
+	(a fraction) slower or bigger, ignoring differences under noise
+	seconds or mem_noise bytes; aggressive's ratio is of time per step,
+	and it is flagged if it stopped otherwise than in base. Returns the
+	number flagged
+	"""
+	bysize = dict((r['size'], r) for r in base['results'])
+	print >> out, '%-6s %-17s %10s %10s %7s %10s %10s' % ('size', 'stage',
+		'baseline', 'now', 'ratio', 'base MB/MB', 'now MB/MB')
+	mb = lambda x: '%10.2f' % x if x is not None else '%10s' % '-'
+	flagged = 0
+	for r in new['results']:
+		b = bysize.get(r['size'])
+		if b is None:
+			continue
+		for s in STAGES + ('peak',):
+			bm, rm = per_mb(b, s), per_mb(r, s)
+			stopped = None
+			if s in r and s in b:
+				bt, rt = b[s], r[s]
+				if s == 'aggressive':
+					# per step, so a run --aggressive-max cut short, or
+					# that took more or fewer steps, still compares
+					bt, rt = bt / step_count(b), rt / step_count(r)
+					if b.get('aggressive_stopped') != r.get('aggressive_stopped'):
+						stopped = '%s after %s steps, not %s after %s' % (
+							r.get('aggressive_stopped'), r.get('aggressive_steps'),
+							b.get('aggressive_stopped'), b.get('aggressive_steps'))
+				ratio = rt / bt if bt else float('inf')
+				# how much longer new took than at base's rate
+				slower = ratio > 1 + threshold and \
+					(rt - bt) * (step_count(r) if s == 'aggressive' else 1) > noise
+				times = '%9.3fs %9.3fs %6.2fx' % (b[s], r[s], ratio)
+			elif bm is not None or rm is not None:
+				slower = False
+				times = '%10s %10s %7s' % ('-', '-', '-')
+			else:
+				continue
+			bigger = bm is not None and rm is not None and \
+				rm > bm * (1 + threshold) and \
+				r['memory'][s] - b['memory'][s] > mem_noise
+			flagged += slower + bigger + bool(stopped)
+			print >> out, '%-6s %-17s %s %s %s%s%s%s' % (r['size'], s, times,
+				mb(bm), mb(rm), '  !! slower' if slower else '',
+				'  !! bigger' if bigger else '',
+				'  !! stopped ' + stopped if stopped else '')
+	return flagged
+
+if __name__ == '__main__':
+	op = OptionParser(usage='%prog run [options] | compare BASELINE RESULTS')
+	op.add_option('--sizes', dest='sizes', default=SIZES, help='sheet sizes to run, up to 50M or so (default %default)')
+	op.add_option('--repeat', dest='repeat', type='int', default=3, metavar='N', help='time each stage N times and keep the best (default %default)')
+	op.add_option('--aggressive-max', dest='aggressive_max', type='float', default=30, metavar='SECONDS', help='stop aggressive() after SECONDS (default %default)')
+	op.add_option('--aggressive-size', dest='aggressive_size', default='1M', metavar='SIZE', help='leave out aggressive() for sheets over SIZE (default %default)')
+	op.add_option('--out', dest='out', metavar='FILE', help='write results to FILE rather than stdout')
+	op.add_option('--threshold', dest='threshold', type='float', default=0.1, metavar='F', help='compare: flag stages over F (a fraction) slower (default %default)')
+	gen.add_options(op)
+	(Opts, Args) = op.parse_args()
+
+	if Args[:1] == ['run'] and len(Args) == 1:
+		results = json.dumps(run(Opts), indent=1, sort_keys=True)
+		if Opts.out:
+			f = open(Opts.out, 'w')
+			f.write(results + '\n')
+			f.close()
+		else:
+			print results
+	elif Args[:1] == ['compare'] and len(Args) == 3:
+		base, new = [json.load(open(a)) for a in Args[1:]]
+		exit(1 if compare(base, new, Opts.threshold) else 0)
+	else:
+		op.error('expected run or compare BASELINE RESULTS')
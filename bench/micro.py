@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Microbenchmarks of the model's hot paths
+
+	micro.py [options] [NAME...]
+
+times each primitive the refactorer leans on by itself: after a
+warmup, --runs runs of as many calls as fill --min-time each, reported
+per call as the min, median and standard deviation over runs. NAMEs
+pick benchmarks by name or prefix (all of them by default); --list
+names them. Primitives that cache their result are timed twice: as is,
+which is mostly cache hits, and _cold, with the cache emptied before
+each call.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import os
+import sys
+import json
+from time import time
+from optparse import OptionParser
+
+Here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(Here, '..', 'src'))
+
+import refactor as cssrefactor
+from parse import CSSDoc, Color, Sel, MINIFY
+from refactor import CSSRefactor, PROPERTIES
+
+SHEET = '''
+div#main .content > ul li a:hover, h1.title + p { color: #FFFFFF; background: #336699 url(img/bg.png) no-repeat }
+.nav { margin-top: 1px; margin-right: 2px; margin-bottom: 1px; margin-left: 2px; font-family: Arial, sans-serif }
+'''
+
+# (name, function returning the callable to time), in the order run
+BENCHMARKS = []
+
+def benchmark(f):
+	BENCHMARKS.append((f.__name__, f))
+	return f
+
+def fixture():
+	doc = CSSDoc.parse(SHEET, lean=True)
+	return doc.rules[0], doc.rules[1]
+
+@benchmark
+def color_init():
+	colors = ['#FFFFFF', '#336699', 'navy', '#abc', 'Yellow']
+	def f():
+		for c in colors:
+			Color(c)
+	return f
+
+@benchmark
+def decl_format():
+	decl = fixture()[0].decls.decl[1]
+	return lambda: decl.format(MINIFY)
+
+@benchmark
+def decl_format_cold():
+	decl = fixture()[0].decls.decl[1]
+	def f():
+		decl.__dict__['_fmt'] = {}
+		decl.format(MINIFY)
+	return f
+
+@benchmark
+def decl_len():
+	decl = fixture()[0].decls.decl[1]
+	return lambda: len(decl)
+
+@benchmark
+def decl_len_cold():
+	decl = fixture()[0].decls.decl[1]
+	def f():
+		decl.__dict__['_len'] = None
+		len(decl)
+	return f
+
+@benchmark
+def sel_init():
+	ops = fixture()[0].sels.sel[0].sel
+	return lambda: Sel(ops)
+
+@benchmark
+def decls_hash():
+	decls = fixture()[0].decls
+	return lambda: hash(decls)
+
+@benchmark
+def decls_hash_cold():
+	decls = fixture()[0].decls
+	def f():
+		decls._key = (None, None)
+		hash(decls)
+	return f
+
+@benchmark
+def css_strcmp():
+	names = ['#main', '.nav', 'a', '*', '@media', '-moz-x', 'body', '.content']
+	def f():
+		for x in names:
+			for y in names:
+				cssrefactor.css_strcmp(x, y)
+	return f
+
+@benchmark
+def vals_merge():
+	merger = PROPERTIES['margin'][1]
+	vals = [d.values[0] for d in fixture()[1].decls.decl[:4]]
+	return lambda: CSSRefactor.vals_merge(merger, vals)
+
+@benchmark
+def properties_merge():
+	decls = fixture()[1].decls.decl[:4]
+	return lambda: CSSRefactor.properties_merge('margin', decls)
+
+def measure(f, runs=7, min_time=0.05):
+	"""
+	seconds per call of f, one figure per run; each run makes as many
+	calls as take min_time, after a warmup run of the same
+	"""
+	number = 1
+	while True:
+		start = time()
+		for _ in xrange(number):
+			f()
+		if time() - start >= min_time:
+			break
+		number *= 2
+	out = []
+	for _ in xrange(runs):
+		start = time()
+		for _ in xrange(number):
+			f()
+		out.append((time() - start) / number)
+	return out
+
+def summary(times):
+	"""min, median and standard deviation of times"""
+	times = sorted(times)
+	n = len(times)
+	median = (times[(n - 1) // 2] + times[n // 2]) / 2
+	mean = sum(times) / n
+	stddev = (sum((t - mean) ** 2 for t in times) / n) ** 0.5
+	return times[0], median, stddev
+
+def selected(names):
+	"""BENCHMARKS whose names start with any of names, or all of them"""
+	return [(n, f) for n, f in BENCHMARKS
+		if not names or any(n.startswith(x) for x in names)]
+
+if __name__ == '__main__':
+	op = OptionParser(usage='%prog [options] [NAME...]')
+	op.add_option('--runs', dest='runs', type='int', default=7, metavar='N', help='timed runs of each (default %default)')
+	op.add_option('--min-time', dest='min_time', type='float', default=0.05, metavar='SECONDS', help='make each run at least SECONDS long (default %default)')
+	op.add_option('--json', dest='json', action='store_true', help='print results as JSON')
+	op.add_option('--list', dest='list', action='store_true', help='list the benchmarks')
+	(Opts, Args) = op.parse_args()
+
+	todo = selected(Args)
+	if Opts.list:
+		for n, _ in todo:
+			print n
+		exit(0)
+	if not todo:
+		op.error('no benchmark is named like ' + ', '.join(Args))
+	results = {}
+	if not Opts.json:
+		print '%-20s %11s %11s %11s' % ('benchmark', 'min', 'median', 'stddev')
+	for name, setup in todo:
+		best, median, stddev = summary(measure(setup(), Opts.runs, Opts.min_time))
+		results[name] = {'min_us': best * 1e6, 'median_us': median * 1e6,
+			'stddev_us': stddev * 1e6}
+		if not Opts.json:
+			print '%-20s %9.3fus %9.3fus %9.3fus' % (name, best * 1e6,
+				median * 1e6, stddev * 1e6)
+	if Opts.json:
+		print json.dumps(results, indent=1, sort_keys=True)
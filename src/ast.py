@@ -1,13 +1,9 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
-class AstNode:
-	def __init__(self, s, tag, start, end, child):
-		self.tag = tag
-		self.start = start
-		self.end = end
-		self.str = s[start:end]
-		self.child = child
+class _Node(object):
+	"""behavior shared by AstNode and CompactAstNode"""
+	__slots__ = ()
 	def __str__(self):
 		if self.child:
 			return '%s(%s)' % (self.tag, str(self.child))
@@ -21,14 +17,33 @@ class AstNode:
 				''.join([c.dump(indent+1) for c in self.child])
 		else:
 			return ins + self.str + '\n'
+
+class AstNode(_Node):
+	# build CompactAstNodes by default
+	Compact = True
+	def __init__(self, s, tag, start, end, child):
+		self.tag = tag
+		self.start = start
+		self.end = end
+		self.str = s[start:end]
+		self.child = child
 	@staticmethod
-	def make(matches, s):
+	def make(matches, s, compact=None):
+		"""build a list of nodes from a parser's match tuples, iteratively
+		so deeply nested input can't exhaust the stack"""
+		if compact is None:
+			compact = AstNode.Compact
+		cls = CompactAstNode if compact else AstNode
 		nodes = []
-		for tag, start, end, child in matches:
-			n = AstNode(s, tag, start, end,
-				AstNode.make(child, s) if child else [])
-			nodes.append(n)
-		return nodes 
+		todo = [(matches, nodes)]
+		while todo:
+			matches, out = todo.pop()
+			for tag, start, end, child in matches:
+				kids = []
+				out.append(cls(s, tag, start, end, kids))
+				if child:
+					todo.append((child, kids))
+		return nodes
 	@staticmethod
 	def Empty():
 		return AstNode('','',0,0,[])
@@ -36,3 +51,19 @@ class AstNode:
 	def Custom(s):
 		return AstNode(s,s,0,max(0, len(s)-1),[])
 
+class CompactAstNode(_Node):
+	"""
+	an AstNode that references its source instead of copying from it;
+	.str is sliced on demand, so a tree costs memory per node rather
+	than per character at each nesting level
+	"""
+	__slots__ = ('src', 'tag', 'start', 'end', 'child')
+	def __init__(self, s, tag, start, end, child):
+		self.src = s
+		self.tag = tag
+		self.start = start
+		self.end = end
+		self.child = child
+	@property
+	def str(self):
+		return self.src[self.start:self.end]
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Batch mode: run a tool over many files in a pool of processes
+
+Each process imports the parser and compiles its grammar once, then
+keeps them for every file it is handed, rather than a process per file
+paying for interpreter startup, imports and grammar compilation.
+css-format.py and css-refactor.py use it when given several files or
+an output directory. What each does to a file is a function here,
+named in WORK, given the tool's options; a process finds it by name,
+so the pool works however its processes are started.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import os
+import sys
+import errno
+from glob import glob
+from time import time
+
+def formatted(contents, opts):
+	"""what css-format.py prints for contents; opts are its options"""
+	import parse as cssparse
+	# the whole file is in memory already, so --stream would only give
+	# the same output more slowly
+	if opts.parse_tree:
+		return str(cssparse.CSSDoc.parse(contents, opts.parser)) + '\n'
+	if opts.minify and opts.minifier == 'stream':
+		from StringIO import StringIO
+		import minify
+		out = StringIO()
+		minify.minify(contents, out, opts.parser)
+		return out.getvalue() + '\n'
+	return cssparse.CSSDoc.parse(contents, opts.parser, lean=True).format(
+		cssparse.MINIFY if opts.minify else cssparse.CANONICAL) + '\n'
+
+def refactored(contents, opts, log=None, jobs=None):
+	"""
+	what css-refactor.py prints for contents; opts are its options,
+	progress goes to log and --aggressive uses jobs processes. run()
+	leaves jobs None: its processes can't start processes of their own
+	"""
+	import parse as cssparse
+	import refactor as cssrefactor
+	CSSRefactor = cssrefactor.CSSRefactor
+	CSSRefactor.Candidates = 'approx' if opts.approx else opts.candidates
+	if opts.bands is not None:
+		CSSRefactor.Bands = opts.bands
+	if opts.similarity is not None:
+		CSSRefactor.Similarity = opts.similarity
+	doc = cssparse.CSSDoc.parse(contents, opts.parser, lean=True)
+	ref = CSSRefactor(doc)
+	if opts.aggressive:
+		if log:
+			print >> log, 'aggressively optimizing...',
+		before = len(ref.format(cssparse.MINIFY))
+		steps = 0
+		for steps in ref.aggressive(yield_step=True, time_max=opts.time_max,
+				min_saving=opts.min_saving, pool_max=opts.pool_max,
+				jobs=jobs):
+			if log:
+				log.write('.')
+		if log:
+			log.write('\n')
+			print >> log, 'stopped (%s) after %u steps, saved %u bytes minified' % (
+				ref.stopped, steps, before - len(ref.format(cssparse.MINIFY)))
+	return ref.format(cssparse.CANONICAL) + '\n'
+
+# what run() can do to each file, by name
+WORK = {
+	'format' : formatted,
+	'refactor' : refactored,
+}
+
+# what _run() does to each file's contents, and the options it's
+# given, in each process of run()
+_work = None
+_opts = None
+
+def _init(work, opts):
+	global _work, _opts
+	_work = WORK[work]
+	_opts = opts
+
+def _run(job):
+	"""
+	write _work() of the file src to dst; returns (src, seconds, bytes
+	in, bytes out, None) or, if it failed, the error in place of None
+	"""
+	src, dst = job
+	start = time()
+	try:
+		f = open(src, 'r')
+		text = f.read()
+		f.close()
+		out = _work(text, _opts)
+		d = os.path.dirname(dst)
+		if d:
+			try:
+				os.makedirs(d)
+			except OSError, e:
+				# another process got there first
+				if e.errno != errno.EEXIST:
+					raise
+		f = open(dst, 'w')
+		f.write(out)
+		f.close()
+		return (src, time() - start, len(text), len(out), None)
+	except Exception, e:
+		return (src, time() - start, 0, 0, str(e).strip() or repr(e))
+
+def expand(args):
+	"""
+	args with any glob patterns replaced by the files they match, in
+	order, each file once; a pattern matching nothing is kept as is, so
+	it fails like a missing file would
+	"""
+	paths = []
+	for a in args:
+		if any(c in a for c in '*?['):
+			paths.extend(sorted(glob(a)) or [a])
+		else:
+			paths.append(a)
+	seen = set()
+	return [p for p in paths if not (p in seen or seen.add(p))]
+
+def outputs(paths, outdir):
+	"""
+	where in outdir each of paths goes: its path below the directory
+	all of paths have in common, so files of the same name in different
+	directories don't collide
+	"""
+	dirs = [os.path.dirname(os.path.abspath(p)).split(os.sep) for p in paths]
+	common = dirs[0] if dirs else []
+	for d in dirs[1:]:
+		n = 0
+		while n < len(common) and n < len(d) and common[n] == d[n]:
+			n += 1
+		common = common[:n]
+	return [os.path.join(outdir, *(d[len(common):] + [os.path.basename(p)]))
+		for p, d in zip(paths, dirs)]
+
+def run(paths, outdir, work, opts, jobs=None, log=sys.stderr):
+	"""
+	write WORK[work](contents, opts) of each of paths to outdir, in
+	jobs processes (all cores if None or 0, in this one if 1), printing
+	each file's timing and a total to log; opts must pickle. Returns
+	the number of files that failed
+	"""
+	import multiprocessing
+	jobs = jobs or multiprocessing.cpu_count()
+	todo = zip(paths, outputs(paths, outdir))
+	start = time()
+	serial = jobs == 1 or len(todo) < 2
+	if serial:
+		_init(work, opts)
+		done = (_run(job) for job in todo)
+	else:
+		pool = multiprocessing.Pool(min(jobs, len(todo)), _init, (work, opts))
+		done = pool.imap(_run, todo)
+	busy, failed = 0.0, 0
+	for src, seconds, size, outsize, error in done:
+		busy += seconds
+		if error:
+			failed += 1
+			print >> log, '%8.3fs  %s: %s' % (seconds, src, error)
+		else:
+			print >> log, '%8.3fs %9u -> %9u  %s' % (seconds, size, outsize, src)
+	if not serial:
+		pool.close()
+		pool.join()
+	procs = 1 if serial else min(jobs, len(todo))
+	print >> log, '%u files%s in %.3fs (%.3fs of work in %u process%s)' % (
+		len(todo), ', %u failed' % failed if failed else '',
+		time() - start, busy, procs, '' if procs == 1 else 'es')
+	return failed
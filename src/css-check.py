@@ -304,16 +304,21 @@ PROPERTIES = {
 	'zoom'				: ('IE5.5',),
 }
 
-def check_properties(doc):
+def property_problems(doc):
+	"""yield a message for each unknown property in doc"""
 	for r in doc.rules:
 		decls = r.decls.decl
 		for d in decls:
 			p = d.property.lower()
 			if p not in PROPERTIES:
 				if not p.startswith('-'): # non-standard extensions
-					print 'Unknown property: "%s": %s: %s' % (
+					yield 'Unknown property: "%s": %s: %s' % (
 						d.property, d.property, ''.join(v.format() for v in d.values))
 
+def check_properties(doc):
+	for problem in property_problems(doc):
+		print problem
+
 def readfile(args):
 	"""convenience function to read from stdin, filename or URL"""
 	contents = None
@@ -322,6 +327,7 @@ def readfile(args):
 		if filename.startswith('http://') \
 		   or filename.startswith('https://') \
 		   or filename.startswith('ftp://'):
+			import urllib2
 			resp = urllib2.urlopen(filename)
 			contents = resp.read()
 		else:
@@ -335,21 +341,26 @@ def readfile(args):
 
 if __name__ == '__main__':
 
-	import urllib2
 	import sys
 	from optparse import OptionParser
 
 	import parse as cssparse
+	import stats
 
 	op = OptionParser()
+	op.add_option('--parser', dest='parser', default='fast', type='choice', choices=('fast', 'ebnf'), help='parse engine: fast (default) or ebnf')
+	stats.add_options(op)
 	#op.add_option('--standards', action='store_true', help='print a nicely formatted, indented representation')
 	(Opts, Args) = op.parse_args()
 
-	filename, contents = get_contents(Args)
+	stats.setup(Opts)
+
+	filename, contents = readfile(Args)
 
-	doc = cssparse.CSSDoc.parse(contents)
+	doc = cssparse.CSSDoc.parse(contents, Opts.parser, lean=True)
 
-	check_properties(doc)
+	with stats.timer('check'):
+		check_properties(doc)
 
 	# TODO:
 	# check for non-web-standard fonts
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+css-format, css-refactor and css-check by way of css-daemon.py
+
+	css-client.py OP [FILE]
+
+prints what the tool would for FILE or stdin, where OP is format,
+minify, refactor, aggressive or check. With no daemon listening, it
+does the work itself.
+"""
+
+import sys
+import json
+import socket
+from optparse import OptionParser
+
+import daemon
+
+op = OptionParser(usage='%prog [options] OP [FILE]')
+op.add_option('--socket', dest='socket', metavar='PATH', help='the daemon\'s socket (default: $CSS_TOOLS_SOCKET or %s)' % daemon.socket_path())
+op.add_option('--time-max', dest='time_max', type='float', metavar='SECONDS', help='as for css-refactor.py --aggressive')
+op.add_option('--min-saving', dest='min_saving', type='int', metavar='BYTES', help='as for css-refactor.py --aggressive')
+op.add_option('--max-pool', dest='pool_max', type='int', metavar='N', help='as for css-refactor.py --aggressive')
+op.add_option('--stats', dest='stats', action='store_true', help='print the daemon\'s request counts and latencies')
+op.add_option('--stop', dest='stop', action='store_true', help='stop the daemon')
+(Opts, Args) = op.parse_args()
+
+if Opts.stats or Opts.stop:
+	resp = daemon.request({'op': 'stats' if Opts.stats else 'stop'}, Opts.socket)
+	if Opts.stats:
+		print json.dumps(resp['stats'], indent=1, sort_keys=True)
+	exit(0)
+
+if not Args or Args[0] not in daemon.OPS:
+	op.error('OP must be one of: ' + ', '.join(daemon.OPS))
+
+if len(Args) > 1:
+	f = open(Args[1], 'r')
+	contents = f.read()
+	f.close()
+else:
+	contents = sys.stdin.read()
+
+# bytes as they are, whatever their encoding; see daemon.py
+req = {'op': Args[0], 'css': contents.decode('latin-1')}
+for k in daemon.AGGRESSIVE:
+	if getattr(Opts, k) is not None:
+		req[k] = getattr(Opts, k)
+try:
+	resp = daemon.request(req, Opts.socket)
+except socket.error:
+	# no daemon; the same, just slower
+	ok, out = daemon.answer(req)
+	resp = {'ok': True, 'out': out} if ok else {'ok': False, 'error': out}
+if not resp['ok']:
+	print >> sys.stderr, resp['error'].encode('latin-1')
+	exit(1)
+sys.stdout.write(resp['out'].encode('latin-1'))
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+keep css-tools warm on a Unix socket for css-client.py; see daemon.py
+"""
+
+from optparse import OptionParser
+
+import daemon
+
+op = OptionParser()
+op.add_option('--socket', dest='socket', metavar='PATH', help='listen on PATH (default: $CSS_TOOLS_SOCKET or %s)' % daemon.socket_path())
+op.add_option('--jobs', dest='jobs', type='int', metavar='N', help='answer N requests at once (default: one per core)')
+(Opts, Args) = op.parse_args()
+
+try:
+	daemon.serve(Opts.socket, Opts.jobs)
+except KeyboardInterrupt:
+	pass
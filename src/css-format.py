@@ -6,32 +6,63 @@
 # TODO:
 # 	* retain comment-using hacks as mentioned in http://developer.yahoo.com/yui/compressor/css.html#hacks
 
-
-from test import CSSUnitTests
-
-class FormatUnitTests(CSSUnitTests):
-	def __init__(self):
-		CSSUnitTests.__init__(self, 'minify')
-
 if __name__ == '__main__':
 
 	import sys
 	from optparse import OptionParser
 
 	import parse as cssparse
+	import stats
 
 	op = OptionParser()
 	op.add_option('--canonical',  dest='canonical',  action='store_true', help='print a nicely formatted, indented representation')
 	op.add_option('--minify',     dest='minify',     action='store_true', help='print the minimal possible equivalent representation')
+	op.add_option('--minifier',   dest='minifier',   default='stream', type='choice', choices=('stream', 'model'), help='minify engine: stream (default) or model')
 	op.add_option('--parse-tree', dest='parse_tree', action='store_true', help='show the internal parse tree')
+	op.add_option('--parser',     dest='parser',     default='fast', type='choice', choices=('fast', 'ebnf'), help='parse engine: fast (default) or ebnf')
+	op.add_option('--stream',     dest='stream',     action='store_true', help='format rule by rule as input arrives, in bounded memory')
+	op.add_option('--out-dir',    dest='out_dir',    metavar='DIR', help='format each of several files or globs into DIR, printing timings')
+	op.add_option('--jobs',       dest='jobs',       type='int', metavar='N', help='with --out-dir, format N files at once (default: one per core)')
+	stats.add_options(op, jobs=True)
 	op.add_option('--test',       dest='test',       action='store_true', help='run unit test')
 	Opts, Args = op.parse_args()
 
+	stats.setup(Opts)
+
 	if Opts.test:
+		# test.py brings in refactor.py and NumPy; nothing else needs them
+		from test import CSSUnitTests
+		class FormatUnitTests(CSSUnitTests):
+			def __init__(self):
+				CSSUnitTests.__init__(self, 'minify')
 		f = FormatUnitTests()
 		f.test()
 		exit(0)
 
+	if Opts.out_dir or len(Args) > 1:
+		if not Opts.out_dir:
+			op.error('formatting several files needs --out-dir')
+		import batch
+		exit(1 if batch.run(batch.expand(Args), Opts.out_dir, 'format',
+			Opts, Opts.jobs) else 0)
+
+	if Opts.minify and Opts.minifier == 'stream' and not Opts.parse_tree:
+		import minify
+		f = open(Args[0], 'r') if Args else sys.stdin
+		minify.minify_stream(f, sys.stdout, Opts.parser)
+		sys.stdout.write('\n')
+		exit(0)
+
+	opts = cssparse.MINIFY if Opts.minify else cssparse.CANONICAL
+
+	if Opts.stream and not Opts.parse_tree:
+		f = open(Args[0], 'r') if Args else sys.stdin
+		items = cssparse.CSSDoc.iterparse(f, Opts.parser)
+		for s in cssparse.CSSDoc.format_stream(items, opts):
+			sys.stdout.write(s)
+		sys.stdout.write('\n')
+		exit(0)
+
 	if Args:
 		filename = Args[0]
 		f = open(filename, 'r')
@@ -41,14 +72,10 @@ if __name__ == '__main__':
 		filename = '-'
 		contents = sys.stdin.read()
 
-	doc = cssparse.CSSDoc.parse(contents)
+	doc = cssparse.CSSDoc.parse(contents, Opts.parser, lean=True)
 
 	if Opts.parse_tree:
 		print doc
 	else:
-		if Opts.minify:
-			cssparse.Format.minify()
-		else:
-			cssparse.Format.canonical()
-		print doc.format()
+		print doc.format(opts)
 
@@ -12,19 +12,41 @@ then, merge any 2+ sub-properties into their common parent
 """
 
 import sys
-from collections import defaultdict
 from optparse import OptionParser
 
-import parse as cssparse
 import refactor as cssrefactor
-
-from parse import Rule, Sels, Decls, Decl, Ident, Delim
+import batch
+import stats
 
 op = OptionParser()
 op.add_option('--aggressive', dest='aggressive', action='store_true', help='perform expensive space-saving optimizations')
+op.add_option('--approx', dest='approx', action='store_true', help='with --aggressive, only try rules MinHash finds similar, for very large sheets')
+op.add_option('--bands', dest='bands', type='int', metavar='N', help='with --approx, LSH bands: more find more similar rules, more slowly (default %u)' % cssrefactor.CSSRefactor.Bands)
+op.add_option('--similarity', dest='similarity', type='float', metavar='J', help='with --approx, the least Jaccard similarity of rules to try (default %g)' % cssrefactor.CSSRefactor.Similarity)
+op.add_option('--time-max', dest='time_max', type='float', metavar='SECONDS', help='stop --aggressive after SECONDS, keeping its result so far')
+op.add_option('--min-saving', dest='min_saving', type='int', default=1, metavar='BYTES', help='stop --aggressive once a step would save fewer than BYTES (default 1)')
+op.add_option('--max-pool', dest='pool_max', type='int', metavar='N', help='stop --aggressive once it would hold more than N candidate subsets, to bound memory')
+op.add_option('--candidates', dest='candidates', default='pairs', type='choice', choices=('pairs', 'itemsets'), help='where --aggressive starts: pairs (default), every two rules\' shared declarations, or itemsets, declarations shared by any number of rules; --approx replaces either')
+op.add_option('--jobs', dest='jobs', type='int', metavar='N', help='with --aggressive, optimize groups of rules that share no declarations in N processes (0: one per core); limits then apply per group. With --out-dir, refactor N files at once instead (default: one per core)')
+op.add_option('--out-dir', dest='out_dir', metavar='DIR', help='refactor each of several files or globs into DIR, printing timings')
+op.add_option('--parser', dest='parser', default='fast', type='choice', choices=('fast', 'ebnf'), help='parse engine: fast (default) or ebnf')
+stats.add_options(op, jobs=True)
 op.add_option('-v', '--verbose', dest='verbose', action='store_true', help='display progress')
 (Opts, Args) = op.parse_args()
 
+if Opts.approx and not Opts.aggressive:
+	op.error('--approx needs --aggressive')
+if (Opts.bands is not None or Opts.similarity is not None) and not Opts.approx:
+	op.error('--bands and --similarity need --approx')
+
+stats.setup(Opts)
+
+if Opts.out_dir or len(Args) > 1:
+	if not Opts.out_dir:
+		op.error('refactoring several files needs --out-dir')
+	exit(1 if batch.run(batch.expand(Args), Opts.out_dir, 'refactor',
+		Opts, Opts.jobs) else 0)
+
 if Args:
 	filename = Args[0]
 	f = open(filename, 'r')
@@ -34,15 +56,5 @@ else:
 	filename = '-'
 	contents = sys.stdin.read()
 
-cssparse.Format.canonical()
-
-doc = cssparse.CSSDoc.parse(contents)
-ref = cssrefactor.CSSRefactor(doc)
-if Opts.aggressive:
-	print >> sys.stderr, 'aggressively optimizing...',
-	for _ in ref.aggressive(yield_step=True, step_max=100):
-		sys.stderr.write('.')
-	sys.stderr.write('\n')
-
-print ref.format()
+sys.stdout.write(batch.refactored(contents, Opts, sys.stderr, Opts.jobs))
 
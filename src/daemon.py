@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+css-tools daemon: format, minify, refactor and check over a Unix socket
+
+Editors and dev servers run the tools on every save. Started once, the
+daemon keeps the interpreter, parsers and property tables warm, and
+hands each request to a pool of processes forked from it, so requests
+are answered concurrently. css-daemon.py starts it; css-client.py
+talks to it.
+
+Requests and responses are one JSON object per line, any number of
+them per connection:
+
+	{"op": "format", "css": "a{b:c}"}
+	{"ok": true, "out": "a {\\n\\tb: c;\\n}\\n", "ms": 0.4}
+
+op is one of OPS; "aggressive" also takes time_max, min_saving and
+pool_max, as css-refactor.py does. "out" is what the tool of that name
+would print. Stylesheets are bytes in no particular encoding, so "css"
+and "out" carry them as latin-1, one character per byte. A failed
+request gets {"ok": false, "error": "..."}. {"op": "stats"} gets
+request counts and latency percentiles by op, all ops not in OPS
+counted as UNKNOWN, and {"op": "stop"} stops the daemon.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import os
+import sys
+import json
+import errno
+import socket
+import threading
+from time import time
+from collections import deque
+
+# what run() does; css-client.py names them the same
+OPS = ('format', 'minify', 'refactor', 'aggressive', 'check')
+
+# where {"op": "stats"} counts requests for an op not in OPS
+UNKNOWN = 'unknown'
+
+# the parameters of aggressive() a request may give
+AGGRESSIVE = ('time_max', 'min_saving', 'pool_max')
+
+def socket_path():
+	"""where the daemon listens: $CSS_TOOLS_SOCKET, or one per user"""
+	return os.environ.get('CSS_TOOLS_SOCKET',
+		'/tmp/css-tools-%u.sock' % os.getuid())
+
+_check = None
+
+def check():
+	"""css-check.py, which a hyphen keeps from being imported by name"""
+	global _check
+	if _check is None:
+		import imp
+		_check = imp.load_source('css_check', os.path.join(
+			os.path.dirname(os.path.abspath(__file__)), 'css-check.py'))
+	return _check
+
+def run(op, css, **opts):
+	"""what the tool op names prints for css"""
+	import parse as cssparse
+	if op not in OPS:
+		raise ValueError('unknown op: %s' % (op,))
+	if op == 'minify':
+		from StringIO import StringIO
+		import minify
+		out = StringIO()
+		minify.minify(css, out)
+		return out.getvalue() + '\n'
+	doc = cssparse.CSSDoc.parse(css, lean=True)
+	if op == 'format':
+		return doc.format(cssparse.CANONICAL) + '\n'
+	if op == 'check':
+		return ''.join(p + '\n' for p in check().property_problems(doc))
+	import refactor as cssrefactor
+	ref = cssrefactor.CSSRefactor(doc)
+	if op == 'aggressive':
+		for _ in ref.aggressive(**dict((k, opts[k]) for k in AGGRESSIVE
+				if opts.get(k) is not None)):
+			pass
+	return ref.format(cssparse.CANONICAL) + '\n'
+
+def answer(req):
+	"""run() for a request in a pool process; (ok, out or error)"""
+	try:
+		opts = dict((str(k), req[k]) for k in AGGRESSIVE if k in req)
+		css = req.get('css', u'').encode('latin-1')
+		return (True, run(req.get('op'), css, **opts).decode('latin-1'))
+	except Exception, e:
+		return (False, (str(e).strip() or repr(e)).decode('latin-1'))
+
+class Stats(object):
+	"""request counts and latencies by op, for {"op": "stats"}"""
+	# latencies kept per op, the most recent
+	Keep = 10000
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.started = time()
+		self.ops = {}
+	def add(self, op, seconds, ok):
+		with self.lock:
+			s = self.ops.get(op)
+			if s is None:
+				s = self.ops[op] = [0, 0, deque(maxlen=Stats.Keep)]
+			s[0] += 1
+			if not ok:
+				s[1] += 1
+			s[2].append(seconds * 1000)
+	def report(self):
+		with self.lock:
+			ops = dict((op, (n, errors, sorted(ms)))
+				for op, (n, errors, ms) in self.ops.iteritems())
+		out = {}
+		for op, (n, errors, ms) in ops.iteritems():
+			r = {'requests': n, 'errors': errors}
+			for p in (50, 90, 99):
+				# nearest rank
+				r['p%u_ms' % p] = round(ms[max(0, (len(ms) * p + 99) // 100 - 1)], 3)
+			r['max_ms'] = round(ms[-1], 3)
+			out[op] = r
+		return {'uptime_s': round(time() - self.started, 3), 'ops': out}
+
+def serve(path=None, jobs=None, log=sys.stderr):
+	"""answer requests on the Unix socket path in jobs processes (one
+	per core if None or 0) until asked to stop"""
+	import SocketServer
+	import multiprocessing
+	# loaded before the pool forks, so every process starts warm
+	import parse, refactor, minify
+	check()
+	path = path or socket_path()
+	if os.path.exists(path):
+		try:
+			request({'op': 'stats'}, path)
+			raise Exception('already running on %s' % (path,))
+		except socket.error:
+			os.unlink(path) # left over from a daemon that died
+
+	class Handler(SocketServer.StreamRequestHandler):
+		def handle(self):
+			for line in iter(self.rfile.readline, ''):
+				start = time()
+				try:
+					req = json.loads(line)
+					if not isinstance(req, dict):
+						raise ValueError('not an object')
+					op = req.get('op')
+				except ValueError, e:
+					req, op = None, None
+					resp = {'ok': False, 'error': 'bad request: %s' % (e,)}
+				if op == 'stats':
+					resp = {'ok': True, 'stats': stats.report()}
+				elif op == 'stop':
+					resp = {'ok': True}
+				elif req is not None and op not in OPS:
+					resp = {'ok': False, 'error': 'unknown op: %s' % (json.dumps(op),)}
+					stats.add(UNKNOWN, time() - start, False)
+					resp['ms'] = round((time() - start) * 1000, 3)
+				elif req is not None:
+					ok, out = pool.apply(answer, (req,))
+					resp = {'ok': True, 'out': out} if ok else \
+						{'ok': False, 'error': out}
+					stats.add(op, time() - start, ok)
+					resp['ms'] = round((time() - start) * 1000, 3)
+				self.wfile.write(json.dumps(resp) + '\n')
+				self.wfile.flush()
+				if op == 'stop':
+					threading.Thread(target=server.shutdown).start()
+					return
+
+	class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+		daemon_threads = True
+
+	stats = Stats()
+	pool = multiprocessing.Pool(jobs or None)
+	# only this user may connect
+	umask = os.umask(077)
+	try:
+		server = Server(path, Handler)
+	finally:
+		os.umask(umask)
+	print >> log, 'listening on %s' % (path,)
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+		pool.terminate()
+		if os.path.exists(path):
+			os.unlink(path)
+
+def request(req, path=None):
+	"""send the daemon at path one request; returns its response"""
+	s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		s.connect(path or socket_path())
+		s.sendall(json.dumps(req) + '\n')
+		f = s.makefile('r')
+		line = f.readline()
+		f.close()
+	finally:
+		s.close()
+	if not line:
+		raise socket.error(errno.ECONNRESET, 'no response')
+	return json.loads(line)
@@ -0,0 +1,697 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Hand-written CSS tokenizer and recursive-descent parser
+
+A linear-time replacement for running CSS_EBNF through simpleparse.
+Parser.parse() returns exactly what simpleparse's Parser.parse() does:
+(ok, [(tag, start, end, children), ...], nextchar), so CSSDoc builds
+its model from either engine without knowing which one ran.
+
+Each production below mirrors its CSS_EBNF counterpart, including
+ordered choice and the lack of backtracking into repetitions. The
+grammar's lexical classes depend on context (url chars, IE '*' names,
+hex digits), so the tokenizer is a table of anchored regexes that the
+parser calls at the current position rather than a separate pass.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import gc
+import re
+
+# tokenizer: each returns a match anchored at pos, or None
+_SPACE    = re.compile(r'[ \t\r\n\v\f]+').match
+_IDENT2   = re.compile(r'-[a-zA-Z_-][a-zA-Z0-9_-]*|[a-zA-Z_][a-zA-Z0-9_-]*').match
+_NAME     = re.compile(r'[*a-zA-Z_-][\\a-zA-Z0-9_-]*').match
+_NUMBER   = re.compile(r'-?[0-9]+(?:\.[0-9]+)?').match
+_HEX      = re.compile(r'[0-9a-fA-F]+').match
+_URLCHARS = re.compile(r'[a-zA-Z0-9~`!@#$%^&*_+{}\[|:,./?-]*').match
+_CHARS    = re.compile(r'(?:[^"\\]|\\[\s\S])*').match
+_SQCHARS  = re.compile(r"[^']*").match
+_S        = re.compile(r'(?:[ \t\r\n\v\f]+|/\*.*?\*/)+', re.S).match
+_S_PART   = re.compile(r'[ \t\r\n\v\f]+|/\*(.*?)\*/', re.S).finditer
+_CALLISH  = re.compile(r'[*a-zA-Z_-][\\a-zA-Z0-9_-]*(?:[:.][*a-zA-Z_-][\\a-zA-Z0-9_-]*)*'
+			r'[ \t\r\n\v\f]*\(').match
+
+# first characters that can start a production, for cheap dispatch
+_NUM_FIRST  = frozenset('-0123456789')
+_NAME_FIRST = frozenset('*-_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_DELIMS     = frozenset('!,/')
+
+# ordered like CSS_EBNF's exprbinop; '||' before '|' never matters
+# since a lone '|' is not an operator
+_BINOPS = ('+', '-', '*', '/', '||', '&&')
+
+class Parser:
+	"""Recursive-descent CSS parser, a drop-in for Parser(CSS_EBNF)"""
+	def parse(self, text, production='css'):
+		if production != 'css':
+			raise ValueError('unsupported production: ' + production)
+		# the result is a large acyclic tree of tuples; collecting while
+		# building it only burns time
+		enabled = gc.isenabled()
+		gc.disable()
+		try:
+			return _Productions(text).css()
+		finally:
+			if enabled:
+				gc.enable()
+
+class _Productions:
+	"""One parse in progress; every method is the CSS_EBNF production of
+	the same name, appending its node to out and returning the end offset,
+	or returning -1 (and appending nothing) on failure"""
+
+	def __init__(self, text):
+		self.text = text
+		self.len = len(text)
+
+	def css(self):
+		out = []
+		pos = 0
+		while pos < self.len:
+			end = self.toplevel(pos, out)
+			if end < 0:
+				break
+			pos = end
+		return (1, out, pos)
+
+	# whitespace and comments
+
+	def s(self, pos, out):
+		m = _S(self.text, pos)
+		if not m:
+			return -1
+		e = m.end()
+		kids = []
+		for m in _S_PART(self.text, pos, e):
+			p, q = m.span()
+			if m.group(1) is None:
+				kids.append(('space', p, q, None))
+			else:
+				kids.append(('comment', p, q, [('commtext', p+2, q-2, [])]))
+		out.append(('s', pos, e, kids))
+		return e
+
+	def space(self, pos, out):
+		m = _SPACE(self.text, pos)
+		if not m:
+			return -1
+		e = m.end()
+		out.append(('space', pos, e, None))
+		return e
+
+	def opt_s(self, pos, out):
+		e = self.s(pos, out)
+		return pos if e < 0 else e
+
+	def opt_space(self, pos, out):
+		e = self.space(pos, out)
+		return pos if e < 0 else e
+
+	# top level
+
+	def toplevel(self, pos, out):
+		kids = []
+		e = self.at_rule(pos, kids)
+		if e < 0:
+			e = self.rule(pos, kids)
+			if e < 0:
+				e = self.s(pos, kids)
+				if e < 0:
+					return -1
+		out.append(('toplevel', pos, e, kids))
+		return e
+
+	def at_rule(self, pos, out):
+		kids = []
+		p = self.at_kword(pos, kids)
+		if p < 0:
+			return -1
+		p = self.s(p, kids)
+		if p < 0:
+			return -1
+		e = self.values(p, kids)
+		if e >= 0:
+			p = e
+		if self.text.startswith(';', p):
+			p += 1
+		out.append(('at_rule', pos, p, kids))
+		return p
+
+	def at_kword(self, pos, out):
+		if not self.text.startswith('@', pos):
+			return -1
+		kids = []
+		e = self.ident(pos+1, kids)
+		if e < 0:
+			return -1
+		out.append(('at_kword', pos, e, kids))
+		return e
+
+	def rule(self, pos, out):
+		kids = []
+		p = self.sels(pos, kids)
+		if p < 0:
+			p = pos
+		p = self.block(p, kids)
+		if p < 0:
+			return -1
+		out.append(('rule', pos, p, kids))
+		return p
+
+	# selectors
+
+	def sels(self, pos, out):
+		kids = []
+		p = self.sel(pos, kids)
+		if p < 0:
+			return -1
+		text = self.text
+		while True:
+			more = []
+			q = self.opt_s(p, more)
+			if not text.startswith(',', q):
+				break
+			q = self.opt_s(q+1, more)
+			q = self.sel(q, more)
+			if q < 0:
+				break
+			kids.extend(more)
+			p = q
+		p = self.opt_s(p, kids)
+		out.append(('sels', pos, p, kids))
+		return p
+
+	def sel(self, pos, out):
+		kids = []
+		p = self.sel_ops(pos, kids)
+		if p < 0:
+			return -1
+		while True:
+			more = []
+			q = self.s(p, more)
+			if q < 0:
+				break
+			q = self.sel_ops(q, more)
+			if q < 0:
+				break
+			kids.extend(more)
+			p = q
+		out.append(('sel', pos, p, kids))
+		return p
+
+	def sel_ops(self, pos, out):
+		kids = []
+		p = pos
+		while True:
+			e = self.sel_op(p, kids)
+			if e < 0:
+				break
+			p = e
+		if not kids:
+			return -1
+		out.append(('sel_ops', pos, p, kids))
+		return p
+
+	def sel_op(self, pos, out):
+		kids = []
+		c = self.text[pos:pos+1]
+		e = self.sel_tag(pos, kids)
+		if e < 0:
+			if c == '.':
+				e = self.sel_prefixed('sel_class', pos, kids)
+			elif c == '#':
+				e = self.sel_prefixed('sel_id', pos, kids)
+			elif c == ':':
+				e = self.sel_prefixed('sel_psuedo', pos, kids)
+			elif c == '>':
+				e = self.sel_combinator('sel_child', pos, kids)
+			elif c == '+':
+				e = self.sel_combinator('sel_adj', pos, kids)
+			elif c == '[':
+				e = self.sel_attr(pos, kids)
+			if e < 0:
+				return -1
+		out.append(('sel_op', pos, e, kids))
+		return e
+
+	def sel_tag(self, pos, out):
+		kids = []
+		e = self.tag(pos, kids)
+		if e < 0:
+			return -1
+		out.append(('sel_tag', pos, e, kids))
+		return e
+
+	def sel_prefixed(self, tag, pos, out):
+		kids = []
+		e = self.tag(pos+1, kids)
+		if e < 0:
+			return -1
+		out.append((tag, pos, e, kids))
+		return e
+
+	def sel_combinator(self, tag, pos, out):
+		kids = []
+		p = self.opt_s(pos+1, kids)
+		e = self.tag(p, kids)
+		if e < 0:
+			return -1
+		out.append((tag, pos, e, kids))
+		return e
+
+	def sel_attr(self, pos, out):
+		kids = []
+		e = self.sel_attr_sel(pos+1, kids)
+		if e < 0 or not self.text.startswith(']', e):
+			return -1
+		out.append(('sel_attr', pos, e+1, kids))
+		return e+1
+
+	def sel_attr_sel(self, pos, out):
+		kids = []
+		p = self.tag(pos, kids)
+		if p < 0:
+			return -1
+		if self.text.startswith('=', p):
+			val = []
+			e = self.any(p+1, val)
+			if e >= 0:
+				kids.append(('sel_attr_op', p, p+1, None))
+				kids.append(('sel_attr_val', p+1, e, val))
+				p = e
+		out.append(('sel_attr_sel', pos, p, kids))
+		return p
+
+	def tag(self, pos, out):
+		kids = []
+		e = self.ident(pos, kids)
+		if e < 0:
+			if not self.text.startswith('*', pos):
+				return -1
+			e = pos + 1
+			kids.append(('sel_univ', pos, e, [('sel_univ2', pos, e, None)]))
+		out.append(('tag', pos, e, kids))
+		return e
+
+	def ident(self, pos, out):
+		m = _IDENT2(self.text, pos)
+		if not m:
+			return -1
+		e = m.end()
+		out.append(('ident', pos, e, [('ident2', pos, e, [])]))
+		return e
+
+	def name(self, pos, out):
+		m = _NAME(self.text, pos)
+		if not m:
+			return -1
+		e = m.end()
+		out.append(('name', pos, e, []))
+		return e
+
+	# declarations
+
+	def block(self, pos, out):
+		if not self.text.startswith('{', pos):
+			return -1
+		kids = []
+		p = self.opt_s(pos+1, kids)
+		p = self.decls(p, kids)
+		p = self.opt_s(p, kids)
+		if not self.text.startswith('}', p):
+			return -1
+		out.append(('block', pos, p+1, kids))
+		return p+1
+
+	def decls(self, pos, out):
+		text = self.text
+		kids = []
+		p = self.decl(pos, kids)
+		if p < 0:
+			p = pos
+		while True:
+			more = []
+			q = self.opt_s(p, more)
+			if not text.startswith(';', q):
+				break
+			q = self.opt_s(q+1, more)
+			e = self.decl(q, more)
+			if e >= 0:
+				q = e
+			kids.extend(more)
+			p = q
+		p = self.opt_s(p, kids)
+		if text.startswith(';', p):
+			p += 1
+		out.append(('decls', pos, p, kids))
+		return p
+
+	def decl(self, pos, out):
+		m = _NAME(self.text, pos)
+		if not m:
+			return -1
+		p = m.end()
+		kids = [('property', pos, p, [('name', pos, p, [])])]
+		p = self.opt_s(p, kids)
+		if not self.text.startswith(':', p):
+			return -1
+		kids.append(('colon', p, p+1, None))
+		p = self.opt_s(p+1, kids)
+		p = self.values(p, kids)
+		if p < 0:
+			return -1
+		out.append(('decl', pos, p, kids))
+		return p
+
+	def values(self, pos, out):
+		kids = []
+		p = self.value(pos, kids)
+		if p < 0:
+			return -1
+		while True:
+			more = []
+			q = self.opt_s(p, more)
+			q = self.value(q, more)
+			if q < 0:
+				break
+			kids.extend(more)
+			p = q
+		p = self.opt_s(p, kids)
+		out.append(('values', pos, p, kids))
+		return p
+
+	def value(self, pos, out):
+		kids = []
+		e = self.any(pos, kids)
+		if e < 0:
+			e = self.block(pos, kids)
+			if e < 0:
+				return -1
+		out.append(('value', pos, e, kids))
+		return e
+
+	# values
+
+	def any(self, pos, out):
+		text = self.text
+		c = text[pos:pos+1]
+		kids = []
+		e = n = -1
+		if c in _NUM_FIRST:
+			num = []
+			n = self.num(pos, num)
+			if n >= 0:
+				# percent := num,'%' / dim := num,ident
+				if text.startswith('%', n):
+					e = n + 1
+					kids.append(('percent', pos, e, num))
+				else:
+					unit = []
+					e = self.ident(n, unit)
+					if e >= 0:
+						kids.append(('dim', pos, e, num + unit))
+		if e >= 0:
+			pass
+		elif c == '#':
+			e = self.hash(pos, kids)
+		elif c == '"':
+			e = self.string(pos, kids)
+		elif c == "'":
+			e = self.sqstring(pos, kids)
+		elif c == 'e' and text.startswith('expression(', pos):
+			e = self.expr(pos, kids)
+		elif c == 'u' and text.startswith('url(', pos):
+			e = self.uri(pos, kids)
+		if e < 0 and c in _NAME_FIRST:
+			# filter and propfunc both need a '(' after a dotted name
+			if _CALLISH(text, pos):
+				e = self.filter(pos, kids)
+				if e < 0:
+					call = []
+					e = self.exprcall(pos, call)
+					if e >= 0:
+						kids.append(('propfunc', pos, e, call))
+			if e < 0:
+				e = self.ident(pos, kids)
+		if e < 0 and n >= 0:
+			e = n
+			kids.extend(num)
+		if e < 0:
+			if text.startswith('=~', pos):
+				e = pos + 2
+				kids.append(('inc', pos, e, None))
+			elif text.startswith('|=', pos):
+				e = pos + 2
+				kids.append(('bareq', pos, e, None))
+			elif c in _DELIMS:
+				e = pos + 1
+				kids.append(('delim', pos, e, [('delimiter', pos, e, [])]))
+			else:
+				return -1
+		out.append(('any', pos, e, kids))
+		return e
+
+	def num(self, pos, out):
+		m = _NUMBER(self.text, pos)
+		if not m:
+			return -1
+		e = m.end()
+		out.append(('num', pos, e, [('number', pos, e, [])]))
+		return e
+
+	def hash(self, pos, out):
+		if not self.text.startswith('#', pos):
+			return -1
+		m = _HEX(self.text, pos+1)
+		if not m:
+			return -1
+		e = m.end()
+		out.append(('hash', pos, e,
+			[('hex', i, i+1, None) for i in xrange(pos+1, e)]))
+		return e
+
+	def string(self, pos, out):
+		text = self.text
+		if not text.startswith('"', pos):
+			return -1
+		e = _CHARS(text, pos+1).end()
+		if not text.startswith('"', e):
+			return -1
+		out.append(('string', pos, e+1, [('chars', pos+1, e, [])]))
+		return e+1
+
+	def sqstring(self, pos, out):
+		text = self.text
+		if not text.startswith("'", pos):
+			return -1
+		e = _SQCHARS(text, pos+1).end()
+		if not text.startswith("'", e):
+			return -1
+		out.append(('sqstring', pos, e+1, [('sqchars', pos+1, e, [])]))
+		return e+1
+
+	def uri(self, pos, out):
+		text = self.text
+		p = pos + 4 # 'url('
+		kids = []
+		e = self.string(p, kids)
+		if e < 0:
+			e = self.sqstring(p, kids)
+			if e < 0:
+				e = _URLCHARS(text, p).end()
+				kids.append(('urlchars', p, e, []))
+		if not text.startswith(')', e):
+			return -1
+		e += 1
+		out.append(('uri', pos, e,
+			[('url', pos, e, [('urlstring', p, e-1, kids)])]))
+		return e
+
+	def filter(self, pos, out):
+		text = self.text
+		kids = []
+		p = self.filtername(pos, kids)
+		if p < 0:
+			return -1
+		p = self.opt_space(p, kids)
+		if not text.startswith('(', p):
+			return -1
+		p = self.opt_space(p+1, kids)
+		kvs = []
+		e = self.filterkvs2(p, kvs)
+		if e >= 0:
+			kids.append(('filterkvs', p, e, kvs))
+			p = e
+		p = self.opt_space(p, kids)
+		if not text.startswith(')', p):
+			return -1
+		out.append(('filter', pos, p+1, kids))
+		return p+1
+
+	def filtername(self, pos, out):
+		text = self.text
+		kids = []
+		p = self.name(pos, kids)
+		if p < 0:
+			return -1
+		for sep in (':', '.'):
+			while text.startswith(sep, p):
+				e = self.name(p+1, kids)
+				if e < 0:
+					break
+				p = e
+		out.append(('filtername', pos, p, kids))
+		return p
+
+	def filterkvs2(self, pos, out):
+		text = self.text
+		kids = []
+		p = self.filterkv(pos, kids)
+		if p < 0:
+			return -1
+		while True:
+			more = []
+			q = self.opt_space(p, more)
+			if not text.startswith(',', q):
+				break
+			q = self.opt_space(q+1, more)
+			q = self.filterkv(q, more)
+			if q < 0:
+				break
+			kids.extend(more)
+			p = q
+		out.append(('filterkvs2', pos, p, kids))
+		return p
+
+	def filterkv(self, pos, out):
+		kids = []
+		p = self.name(pos, kids)
+		if p < 0 or not self.text.startswith('=', p):
+			return -1
+		p = self.sqstring(p+1, kids)
+		if p < 0:
+			return -1
+		out.append(('filterkv', pos, p, kids))
+		return p
+
+	# IE expression() and function calls
+
+	def expr(self, pos, out):
+		text = self.text
+		kids = []
+		p = self.opt_space(pos + 11, kids) # 'expression('
+		e = self.exprexpr(p, kids)
+		if e >= 0:
+			p = e
+		p = self.opt_space(p, kids)
+		if not text.startswith(')', p):
+			return -1
+		out.append(('expr', pos, p+1, kids))
+		return p+1
+
+	def exprexpr(self, pos, out):
+		kids = []
+		p = self.exprterm(pos, kids)
+		if p < 0:
+			return -1
+		while True:
+			more = []
+			q = self.opt_space(p, more)
+			q = self.exprop(q, more)
+			if q < 0:
+				break
+			kids.extend(more)
+			p = q
+		out.append(('exprexpr', pos, p, kids))
+		return p
+
+	def exprop(self, pos, out):
+		text = self.text
+		for op in _BINOPS:
+			if text.startswith(op, pos):
+				break
+		else:
+			return -1
+		e = pos + len(op)
+		kids = [('exprbinop', pos, e, [])]
+		p = self.opt_space(e, kids)
+		p = self.exprexpr(p, kids)
+		if p < 0:
+			return -1
+		out.append(('exprop', pos, p, kids))
+		return p
+
+	def exprterm(self, pos, out):
+		text = self.text
+		kids = []
+		e = self.num(pos, kids)
+		if e < 0 and text.startswith("'", pos):
+			e = _SQCHARS(text, pos+1).end()
+			if text.startswith("'", e):
+				e += 1
+				kids.append(('exprstr', pos, e, []))
+			else:
+				e = -1
+		if e < 0 and text.startswith('(', pos):
+			p = self.opt_space(pos+1, kids)
+			q = self.exprexpr(p, kids)
+			if q >= 0:
+				p = q
+			p = self.opt_space(p, kids)
+			if text.startswith(')', p):
+				e = p + 1
+			else:
+				del kids[:]
+		if e < 0:
+			e = self.exprcall(pos, kids)
+		if e < 0:
+			e = self.exprident(pos, kids)
+		if e < 0:
+			return -1
+		out.append(('exprterm', pos, e, kids))
+		return e
+
+	def exprcall(self, pos, out):
+		text = self.text
+		kids = []
+		p = self.exprident(pos, kids)
+		if p < 0 or not text.startswith('(', p):
+			return -1
+		p = self.opt_space(p+1, kids)
+		e = self.exprexpr(p, kids)
+		if e >= 0:
+			p = e
+		while True:
+			more = []
+			q = self.opt_space(p, more)
+			if not text.startswith(',', q):
+				break
+			q = self.exprexpr(q+1, more)
+			if q < 0:
+				break
+			kids.extend(more)
+			p = q
+		p = self.opt_space(p, kids)
+		if not text.startswith(')', p):
+			return -1
+		out.append(('exprcall', pos, p+1, kids))
+		return p+1
+
+	def exprident(self, pos, out):
+		text = self.text
+		kids = []
+		p = self.name(pos, kids)
+		if p < 0:
+			return -1
+		while text.startswith('.', p):
+			e = self.name(p+1, kids)
+			if e < 0:
+				break
+			p = e
+		out.append(('exprident', pos, p, kids))
+		return p
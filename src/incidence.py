@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Rule x declaration incidence matrix, with NumPy
+
+Finds the declaration subsets that rules share, and what extracting
+each would save, with vectorized operations over bit-packed rows instead
+of Python loops over pairs of rules. CSSRefactor.aggressive() uses it
+for its initial pass over large stylesheets when NumPy is installed.
+
+Sets of decl ids are the int bitmasks CSSRefactor uses when Compact:
+bit i of a row is set if the rule contains interned decl i.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+from binascii import hexlify, unhexlify
+
+import numpy as np
+
+# set bits in each byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+def bitmatrix(rows):
+	"""packed uint64 rows to a bool matrix, one column per bit"""
+	n, w = rows.shape
+	b = (rows[:, :, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+	return b.reshape(n, w * 64).astype(bool)
+
+class Incidence:
+	"""
+	masks: each rule's decl id bitmask; declen: each decl id's length;
+	sellen: each rule's selector length
+	"""
+	# bytes in the largest temporary scores() makes
+	Temp = 1 << 24
+	def __init__(self, masks, declen, sellen):
+		self.nbytes = max(8, (len(declen) + 63) // 64 * 8)
+		self.rows = self.pack(masks)
+		self.sellen = np.array(sellen, dtype=np.int64)
+		self.declen = np.zeros(self.nbytes * 8, dtype=np.int64)
+		self.declen[:len(declen)] = declen
+		self.postings = self.transpose(self.rows)
+	def transpose(self, rows):
+		"""
+		packed rows' transpose, packed: bit r of row i is set if rule r
+		contains decl i. Made a block of rules and words at a time, so
+		that bitmatrix()'s temporary stays within Temp
+		"""
+		n, w = rows.shape
+		out = np.zeros((w * 64, (n + 7) // 8), dtype=np.uint8)
+		# bitmatrix() holds 64 uint64s per word of a row
+		span = max(8, self.Temp // (64 * 8) // 8 * 8)
+		for r in xrange(0, n, span):
+			block = rows[r:r+span]
+			words = max(1, self.Temp // (len(block) * 64 * 8))
+			for at in xrange(0, w, words):
+				b = bitmatrix(block[:, at:at+words])
+				out[at*64:at*64+b.shape[1], r//8:r//8+(len(block)+7)//8] = \
+					np.packbits(b.T, axis=1)
+		return out
+	def pack(self, masks):
+		"""int bitmasks to a (len(masks) x words) uint64 array"""
+		n = self.nbytes
+		buf = ''.join(unhexlify('%0*x' % (n * 2, m))[::-1] for m in masks)
+		return np.frombuffer(buf, dtype='<u8').reshape(len(masks), n // 8)
+	def unpack(self, row):
+		"""a packed row back to an int bitmask"""
+		return int(hexlify(row.astype('<u8').tostring()[::-1]), 16)
+	def overlaps(self, stop=None):
+		"""
+		every nonempty intersection of two rows, as int bitmasks;
+		stop(n) is checked as the n so far are collected and the search
+		ends early if it returns true
+		"""
+		rows = self.rows
+		# whole rows as single values, so np.unique() dedups them
+		void = np.dtype((np.void, self.nbytes))
+		found = set()
+		for i in xrange(len(rows) - 1):
+			x = rows[i+1:] & rows[i]
+			x = x[x.any(1)]
+			if len(x):
+				found.update(np.unique(
+					np.ascontiguousarray(x).view(void).ravel()).tolist())
+			if stop and stop(len(found)):
+				break
+		if not found:
+			return []
+		return [self.unpack(row) for row in
+			np.frombuffer(''.join(found), dtype='<u8').reshape(-1, self.nbytes // 8)]
+	def scores(self, masks):
+		"""
+		for each int bitmask, the bytes extracting it would save, as
+		CSSRefactor.overlap_score() has it: its decls' length times the
+		rules containing all of them, less those rules' selectors; 0
+		when fewer than two rules contain it
+		"""
+		if not masks:
+			return []
+		nrules = len(self.rows)
+		chunk = max(1, self.Temp // (nrules + self.nbytes * 8))
+		out = []
+		for at in xrange(0, len(masks), chunk):
+			k = bitmatrix(self.pack(masks[at:at+chunk]))
+			# the rules containing each candidate: the AND of its
+			# decls' postings, like CSSRefactor.index_lookup()
+			cand, decl = np.nonzero(k)
+			first = np.flatnonzero(np.r_[True, cand[1:] != cand[:-1]])
+			within = np.bitwise_and.reduceat(self.postings[decl], first, axis=0)
+			count = POPCOUNT[within].sum(1)
+			sel = np.unpackbits(within, axis=1)[:, :nrules].dot(self.sellen)
+			score = k.dot(self.declen) * count - sel
+			score[count < 2] = 0
+			out.extend(score.tolist())
+		return out
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Frequent itemset mining by FP-growth
+
+Finds the sets of items that at least min_support transactions have in
+common, without enumerating pairs of transactions. CSSRefactor uses it
+to find declarations shared by several rules (items are decl ids,
+transactions are rules).
+
+Ref: Han, Pei, Yin: "Mining Frequent Patterns without Candidate Generation", SIGMOD 2000
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+from collections import defaultdict
+
+class _Node(object):
+	"""FP-tree node; next links the nodes of the same item"""
+	__slots__ = ('item', 'count', 'parent', 'children', 'next')
+	def __init__(self, item, parent):
+		self.item = item
+		self.count = 0
+		self.parent = parent
+		self.children = {}
+		self.next = None
+
+def _tree(transactions, min_support):
+	"""
+	build an FP-tree of (items, count) transactions; returns the
+	support of each frequent item and the head of each item's node list
+	"""
+	counts = defaultdict(int)
+	for items, n in transactions:
+		for i in items:
+			counts[i] += n
+	support = dict((i, c) for i, c in counts.iteritems() if c >= min_support)
+	root = _Node(None, None)
+	header = {}
+	for items, n in transactions:
+		# most frequent first, so common prefixes share nodes
+		node = root
+		for i in sorted((i for i in items if i in support),
+				key=lambda i: (-support[i], i)):
+			child = node.children.get(i)
+			if child is None:
+				child = node.children[i] = _Node(i, node)
+				child.next = header.get(i)
+				header[i] = child
+			child.count += n
+			node = child
+	return support, header
+
+def fpgrowth(transactions, min_support=2, max_size=None, prune=None):
+	"""
+	yield (itemset, support) for each set of items found together in
+	at least min_support of transactions, a list of item lists.
+	itemsets grow no larger than max_size; if prune(itemset, support)
+	is true, neither itemset nor any larger set containing it is yielded
+	"""
+	def grow(transactions, suffix):
+		support, header = _tree(transactions, min_support)
+		# least frequent first, as in the paper
+		for i in sorted(support, key=lambda i: (support[i], i)):
+			itemset = suffix + (i,)
+			if prune and prune(itemset, support[i]):
+				continue
+			yield itemset, support[i]
+			if max_size is not None and len(itemset) >= max_size:
+				continue
+			# the conditional pattern base: the prefix paths of i
+			base = []
+			node = header[i]
+			while node:
+				path = []
+				p = node.parent
+				while p.item is not None:
+					path.append(p.item)
+					p = p.parent
+				if path:
+					base.append((path, node.count))
+				node = node.next
+			if base:
+				for found in grow(base, itemset):
+					yield found
+	return grow([(t, 1) for t in transactions], ())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Memory by phase, for --mem-report
+
+parse.py, refactor.py and minify.py call checkpoint() as each phase
+ends: the parse tree, the AST, the model, CSSRefactor() and
+aggressive(), aggressive() after each step too, and the minifier after
+each chunk. Off until enable(), when it does nothing; once on, each
+checkpoint from the first, 'start', records
+
+	rss	resident bytes as the phase ended
+	peak	the most resident at once during the phase; on Linux the
+		high-water mark is reset at each checkpoint, elsewhere it is
+		the process's peak so far
+	census	unless objects=False, the live objects by type, so the report
+		names the types each phase left behind the most of
+
+Python 2 has no tracemalloc to tie allocations to lines, so the census
+goes by type instead; it sees what gc tracks (instances, lists, dicts
+and the like), not strs and ints, and counts each object's own size,
+not what it refers to. Taking one walks every object, so the steps of
+aggressive() are recorded without one.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import gc
+import sys
+import json
+
+Enabled = False
+# [name, times in a row, rss, peak, census or None], in order
+Phases = []
+# types listed per phase
+Top = 5
+
+def enable(on=True):
+	global Enabled
+	Enabled = on
+	if on:
+		reset_peak()
+		checkpoint('start')
+
+def reset():
+	del Phases[:]
+
+def status():
+	"""(resident, high-water) bytes from /proc, or None without it"""
+	try:
+		f = open('/proc/self/status')
+	except IOError:
+		return None
+	got = {}
+	for line in f:
+		if line.startswith(('VmRSS:', 'VmHWM:')):
+			got[line[:5]] = int(line.split()[1]) * 1024
+	f.close()
+	return got.get('VmRSS'), got.get('VmHWM')
+
+def reset_peak():
+	"""start the high-water mark over, where Linux (4.0+) can; whether it did"""
+	try:
+		f = open('/proc/self/clear_refs', 'w')
+		f.write('5')
+		f.close()
+		return True
+	except IOError:
+		return False
+
+def rss():
+	"""(resident, peak) bytes now"""
+	s = status()
+	if s and s[0] is not None and s[1] is not None:
+		return s
+	import resource
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# kilobytes but on Mac OS X
+	return None, peak if sys.platform == 'darwin' else peak * 1024
+
+def census():
+	"""{type name: [objects, bytes]} of what gc tracks"""
+	out = {}
+	for o in gc.get_objects():
+		# old-style instances are all of type instance
+		name = getattr(o, '__class__', type(o)).__name__
+		c = out.get(name)
+		if c is None:
+			c = out[name] = [0, 0]
+		c[0] += 1
+		c[1] += sys.getsizeof(o, 0)
+	return out
+
+def checkpoint(name, objects=True):
+	"""phase name just ended; objects=False skips the census"""
+	if not Enabled:
+		return
+	now, peak = rss()
+	last = Phases[-1] if Phases else None
+	if last and last[0] == name and not objects:
+		# the same phase again, e.g. a step: one row for the run of them
+		last[1] += 1
+		last[2] = now
+		last[3] = max(last[3], peak)
+	else:
+		Phases.append([name, 1, now, peak, census() if objects else None])
+	reset_peak()
+
+def grown(before, after, top=Top):
+	"""the top types by bytes more in census after than before, as
+	(name, objects, bytes)"""
+	diff = []
+	for name, (n, size) in after.iteritems():
+		n0, size0 = before.get(name, (0, 0))
+		if size > size0:
+			diff.append((name, n - n0, size - size0))
+	diff.sort(key=lambda x: (-x[2], x[0]))
+	return diff[:top]
+
+def rows(top=Top):
+	"""Phases as dicts, each census as what grew since the one before"""
+	out = []
+	before = {}
+	for name, n, now, peak, c in Phases:
+		r = {'phase': name, 'times': n, 'rss': now, 'peak': peak}
+		if c is not None:
+			r['grown'] = [{'type': t, 'objects': k, 'bytes': b}
+				for t, k, b in grown(before, c, top)]
+			before = c
+		out.append(r)
+	return out
+
+def report(out, form='text', top=Top):
+	"""write the phases to out, as text or json"""
+	rs = rows(top)
+	if form == 'json':
+		out.write(json.dumps({'phases': rs}, indent=1, sort_keys=True) + '\n')
+		return
+	mb = lambda x: '%9.1f' % (x / 1048576.0) if x is not None else '%9s' % '-'
+	print >> out, '%-24s %6s %9s %9s' % ('phase', 'times', 'rss MB', 'peak MB')
+	for r in rs:
+		print >> out, '%-24s %6u %s %s' % (r['phase'], r['times'],
+			mb(r['rss']), mb(r['peak']))
+		for g in r.get('grown', ()):
+			print >> out, '    %-20s %+10d objects %+12d bytes' % (
+				g['type'], g['objects'], g['bytes'])
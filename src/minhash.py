@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Similar sets by MinHash and locality-sensitive hashing
+
+Finds the sets likely to be alike by Jaccard measure (|x & y| / |x | y|)
+without comparing every pair. Each set is signed with bands x rows
+MinHash values; sets agreeing on all the rows of a band share that
+band's bucket, and only sets sharing a bucket are compared. Sets of
+similarity s share some bucket with probability 1 - (1 - s**rows)**bands:
+more bands find more of the similar sets, more rows fewer dissimilar
+ones. CSSRefactor uses it to find rules worth intersecting in sheets too
+large to try every pair (items are decl ids, sets are rules).
+
+Ref: Broder: "On the resemblance and containment of documents", 1997
+Ref: Leskovec, Rajaraman, Ullman: "Mining of Massive Datasets", ch. 3
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+from random import Random
+from collections import defaultdict
+
+# a Mersenne prime, above any item
+PRIME = (1 << 61) - 1
+
+class LSH(object):
+	"""
+	keys indexed by the MinHash signature of their sets of int items;
+	the same seed always gives the same hash functions
+	"""
+	def __init__(self, bands=20, rows=3, crowd=None, seed=1):
+		self.bands = bands
+		self.rows = rows
+		self.crowd = crowd
+		rnd = Random(seed)
+		self.hashes = [(rnd.randrange(1, PRIME), rnd.randrange(PRIME))
+				for _ in xrange(bands * rows)]
+		# each item's hash values, and each key's buckets
+		self.items = {}
+		self.keys = {}
+		self.buckets = defaultdict(set)
+	def item(self, i):
+		h = self.items.get(i)
+		if h is None:
+			h = self.items[i] = tuple([(a * i + b) % PRIME
+					for a, b in self.hashes])
+		return h
+	def signature(self, items):
+		"""the least of items' values for each hash function"""
+		return map(min, zip(*map(self.item, items)))
+	def add(self, key, items):
+		"""index key by its set of items, replacing any it had"""
+		self.remove(key)
+		if not items:
+			return
+		sig = self.signature(items)
+		r = self.rows
+		buckets = [(n, tuple(sig[n*r:n*r+r])) for n in xrange(self.bands)]
+		for b in buckets:
+			self.buckets[b].add(key)
+		self.keys[key] = buckets
+	def remove(self, key):
+		for b in self.keys.pop(key, ()):
+			bucket = self.buckets[b]
+			bucket.discard(key)
+			if not bucket:
+				del self.buckets[b]
+	def near(self, key):
+		"""
+		the other keys sharing any bucket with key; buckets of more than
+		crowd keys are passed over, as what puts so many together is
+		likely one common item rather than likeness
+		"""
+		found = set()
+		crowd = self.crowd
+		for b in self.keys.get(key, ()):
+			bucket = self.buckets[b]
+			if crowd is None or len(bucket) <= crowd:
+				found.update(bucket)
+		found.discard(key)
+		return found
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Streaming CSS minifier
+
+Writes the same bytes as CSSDoc.format(MINIFY), but
+straight from the parser's (tag, start, end, children) matches: no
+AstNode, Rule, Decl or value objects are built. Input is read with
+toplevel_chunks(), so output starts before the input is fully read and
+memory is bounded by the largest rule.
+
+Every rule here mirrors a format() method in parse.py; a change to one
+must be made to the other. test.py checks they agree on test/format/.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import stats
+import memory
+from parse import CSSDoc, Color, toplevel_chunks
+
+# value kinds Decl.format() spaces around
+_PLAIN, _DELIM, _URI = 0, 1, 2
+
+# sel_op tags that need a space before them to mean "descendant"
+_SPACED_OPS = ('sel_tag', 'sel_class', 'sel_id')
+
+def _spaceless(nodes):
+	return [n for n in nodes if n[0] not in ('s', 'comment')]
+
+class Minifier:
+	"""minify parse trees of text, appending output strings to out"""
+
+	def __init__(self, text, out):
+		self.text = text
+		self.out = out
+
+	def css(self, tops):
+		text = self.text
+		out = self.out
+		for _, _, _, child in tops:
+			tag, _, _, kids = child[0]
+			if tag == 'rule':
+				self.rule(kids)
+			elif tag == 's':
+				for t, start, end, _ in kids:
+					if t != 'comment':
+						continue
+					txt = text[start+2:end-2]
+					if txt == '' or '\\' in txt:
+						# see CSSDoc.format_stream()
+						out.append('/*' + txt[max(0, txt.find('\\')):] + '*/')
+					elif txt.endswith('/*'):
+						# see Comment.format()
+						out.append('/*' + txt + '*/')
+
+	def rule(self, kids):
+		if kids[0][0] == 'sels':
+			self.sels(kids[0][3])
+		self.block(kids[-1][3])
+
+	def sels(self, kids):
+		first = True
+		for sel in _spaceless(kids):
+			if not first:
+				self.out.append(',')
+			first = False
+			self.sel(sel[3])
+
+	def sel(self, kids):
+		out = self.out
+		first = True
+		for _, _, _, ops in _spaceless(kids):
+			if not first and ops[0][3][0][0] in _SPACED_OPS:
+				out.append(' ')
+			first = False
+			for op in ops:
+				self.sel_op(op[3][0])
+
+	def sel_op(self, node):
+		text = self.text
+		out = self.out
+		tag, _, _, kids = node
+		arg = _spaceless(kids)[0]
+		if tag == 'sel_attr':
+			args = arg[3]
+			s = '[' + text[args[0][1]:args[0][2]]
+			if len(args) > 1:
+				s += '=' + self.value(args[2][3][0])[1]
+			out.append(s + ']')
+			return
+		s = text[arg[1]:arg[2]]
+		if tag == 'sel_tag':	out.append(s)
+		elif tag == 'sel_class':out.append('.' + s)
+		elif tag == 'sel_id':	out.append('#' + s)
+		elif tag == 'sel_psuedo':out.append(':' + s)
+		elif tag == 'sel_child':
+			h = kids[0][3][0]
+			if h[0] == 'comment' and text[h[1]:h[2]] == '/**/':
+				# child selector hack, see Sel_Op.__init__()
+				out.append('>/**/' + s)
+			else:
+				out.append('>' + s)
+		elif tag == 'sel_adj':	out.append('+' + s)
+
+	def block(self, kids):
+		decls = _spaceless(kids)[0][3]
+		out = self.out
+		out.append('{')
+		first = True
+		for decl in _spaceless(decls):
+			if not first:
+				out.append(';')
+			first = False
+			self.decl(decl[3])
+		out.append('}')
+
+	def decl(self, c):
+		text = self.text
+		# see Decl.from_ast() for which whitespace survives
+		col = 1
+		while c[col][0] != 'colon':
+			col += 1
+		vals = col + 1
+		while c[vals][0] != 'values':
+			vals += 1
+		s = text[c[0][1]:c[0][2]]
+		if col == 2:
+			s += text[c[1][1]:c[1][2]]
+		s += ':'
+		if vals == col + 2:
+			s += text[c[col+1][1]:c[col+1][2]].strip()
+		self.out.append(s)
+		self.values(c[vals][3])
+
+	def values(self, kids):
+		out = self.out
+		prev = None # NOTE: Decl.format() never treats the first value as prev
+		for i, v in enumerate(_spaceless(kids)):
+			kind, s = self.value(v[3][0])
+			if i:
+				if kind != _DELIM and prev not in (_DELIM, _URI):
+					out.append(' ')
+				prev = kind
+			if s is None:
+				self.block(v[3][0][3])
+			else:
+				out.append(s)
+
+	def value(self, v):
+		"""(kind, minified text) for a value's any/block node;
+		text is None for a nested block, which the caller writes"""
+		text = self.text
+		tag, _, _, kids = v
+		x = kids[0]
+		xtag, start, end, xkids = x
+		if tag == 'block':
+			if xtag != 'decls':
+				raise Exception('unexpected: Value.from_ast() x.tag: ' + xtag)
+			return (_PLAIN, None)
+		if xtag == 'ident':
+			s = text[start:end]
+			if s.lower() in Color.KEYWORDS:
+				return (_PLAIN, Color(s).shortest)
+			return (_PLAIN, s)
+		elif xtag == 'hash':
+			return (_PLAIN, Color(text[start:end]).shortest)
+		elif xtag == 'dim':
+			n = xkids[0]
+			num = text[n[1]:n[2]]
+			if num == '0':
+				return (_PLAIN, num)
+			return (_PLAIN, text[start:end])
+		elif xtag == 'percent':
+			num = text[start:end-1]
+			return (_PLAIN, num if num == '0' else num + '%')
+		elif xtag == 'uri':
+			u = xkids[0][3][0][3][0]
+			url = text[u[1]:u[2]]
+			if u[0] in ('string', 'sqstring') and url.find(')') == -1:
+				url = url[1:-1]
+			return (_URI, 'url(' + url + ')')
+		elif xtag == 'delim':
+			return (_DELIM, text[start:end])
+		elif xtag in ('num', 'string', 'sqstring', 'expr', 'propfunc', 'filter'):
+			return (_PLAIN, text[start:end])
+		raise Exception('unexpected: Value.from_ast() x.tag: ' + xtag)
+
+def minify(text, sink, parser=None):
+	"""write the minified form of CSS text to sink"""
+	out = []
+	tree = CSSDoc.parse_tree(text, parser)
+	with stats.timer('minify'):
+		Minifier(text, out).css(tree)
+	sink.write(''.join(out))
+	# a row for all of a stream's chunks, so no census
+	memory.checkpoint('minify', objects=False)
+
+def minify_stream(f, sink, parser=None, chunksize=65536):
+	"""minify CSS from file object f to sink, rule by rule"""
+	for text in toplevel_chunks(f, chunksize):
+		minify(text, sink, parser)
@@ -8,12 +8,16 @@ Copyright 2011 Ryan Flynn <parseerror@gmail.com>
 MIT licensed: http://www.opensource.org/licenses/mit-license.php
 """
 
-from simpleparse.parser import Parser
-from itertools import chain
+from itertools import chain, count
+from collections import namedtuple
+import re
 from sys import stdin
-import fcntl, os, sys
+import fcntl, gc, os, sys
 
 from ast import AstNode
+import fastparse
+import stats
+import memory
 
 # TODO: rgb(r,g,b[,a])
 # TODO: hsl(%,%,%)
@@ -101,11 +105,108 @@ comment  := '/*', commtext, '*/'
 commtext := -"*/"*
 '''
 
+class EBNFParser(object):
+	"""
+	simpleparse's Parser(grammar), but neither simpleparse is imported
+	nor the grammar compiled until the first parse; the compiled tag
+	tables are kept in CacheDir, so later processes load them instead
+	"""
+	CacheDir = os.environ.get('CSS_TOOLS_CACHE',
+		os.path.join(os.path.expanduser('~'), '.cache', 'css-tools'))
+	def __init__(self, grammar):
+		self.grammar = grammar
+		self.tables = {}
+	def parse(self, text, production='css'):
+		"""as Parser.parse(): (ok, children, next char)"""
+		from simpleparse.stt.TextTools.TextTools import tag
+		return tag(text, self.table(production), 0, len(text))
+	def table(self, production):
+		t = self.tables.get(production)
+		if t is None:
+			t = self.tables[production] = self.load(production)
+		return t
+	def load(self, production):
+		"""production's table from the cache, or compiled into it"""
+		import cPickle, hashlib, simpleparse, tempfile
+		from simpleparse.parser import Parser
+		key = hashlib.md5('%s\0%s\0%s' % (simpleparse.__version__,
+			production, self.grammar)).hexdigest()
+		path = os.path.join(EBNFParser.CacheDir, key + '.pickle')
+		try:
+			f = open(path, 'rb')
+			try:
+				return cPickle.load(f)
+			finally:
+				f.close()
+		except Exception:
+			pass
+		t = Parser(self.grammar).buildTagger(production)
+		# the cache is only a shortcut; if it can't be written, compile
+		# again next time. Written aside and renamed, so processes
+		# racing to it never read a partial file
+		tmp = None
+		try:
+			if not os.path.isdir(EBNFParser.CacheDir):
+				os.makedirs(EBNFParser.CacheDir)
+			fd, tmp = tempfile.mkstemp(dir=EBNFParser.CacheDir)
+			f = os.fdopen(fd, 'wb')
+			cPickle.dump(t, f, 2)
+			f.close()
+			os.rename(tmp, path)
+		except (IOError, OSError):
+			if tmp and os.path.exists(tmp):
+				os.unlink(tmp)
+		return t
+
 # TODO: disparate values like Percent and Dimension should __cmp__ equal
 # if they're both '0'
 
+class FormatOptions(namedtuple('FormatOptions', [
+		'minify',
+		'unmodified',
+		'indent_char',
+		'op_space',
+		'block_indent',
+		'property_leading_space',
+		'value_leading_space',
+		'last_semi',
+		'one_per_line',
+		'newline', # TODO: detect Windows/UNIX line endings
+	])):
+	"""
+	Immutable options for CSS formatting, passed down through format().
+	Use CANONICAL or MINIFY, or derive a variant with _replace().
+	"""
+	__slots__ = ()
+
+CANONICAL = FormatOptions(
+	minify			= False,
+	unmodified		= False,
+	indent_char		= '\t',
+	op_space		= True,
+	block_indent		= True,
+	property_leading_space	= True,
+	value_leading_space	= True,
+	last_semi		= True,
+	one_per_line		= True,
+	newline			= '\n',
+)
+
+MINIFY = CANONICAL._replace(
+	minify			= True,
+	op_space		= False,
+	block_indent		= False,
+	property_leading_space	= False,
+	value_leading_space	= False,
+	last_semi		= False,
+	one_per_line		= False,
+)
+
 class Format:
-	"""Options for CSS formatting"""
+	"""
+	Global options for CSS formatting, kept for compatibility: format()
+	called without a FormatOptions uses whatever was set here last.
+	"""
 	Minify = False
 	Unmodified = False
 	Stack = []
@@ -122,27 +223,31 @@ class Format:
 			LeadingSpace = False
 		LastSemi = True
 		OnePerLine = True
-		NewLine = '\n' # TODO: detect Windows/UNIX line endings
+		NewLine = '\n'
+	@staticmethod
+	def current():
+		"""the global settings as a FormatOptions"""
+		return FormatOptions(
+			minify			= Format.Minify,
+			unmodified		= Format.Unmodified,
+			indent_char		= Format.Indent.Char,
+			op_space		= Format.Spec.OpSpace,
+			block_indent		= Format.Block.Indent,
+			property_leading_space	= Format.Decl.Property.LeadingSpace,
+			value_leading_space	= Format.Decl.Value.LeadingSpace,
+			last_semi		= Format.Decl.LastSemi,
+			one_per_line		= Format.Decl.OnePerLine,
+			newline			= Format.Decl.NewLine)
 	@staticmethod
 	def canonical():
 		Format.Stack.append('canonical')
-		Format.Minify = False
-		Format.Spec.OpSpace = True
-		Format.Block.Indent = True
-		Format.Decl.Property.LeadingSpace = True
-		Format.Decl.Value.LeadingSpace = True
-		Format.Decl.LastSemi = True
-		Format.Decl.OnePerLine = True
+		stats.sample('format.stack_depth', len(Format.Stack))
+		Format.set(CANONICAL)
 	@staticmethod
 	def minify():
 		Format.Stack.append('minify')
-		Format.Minify = True
-		Format.Spec.OpSpace = False
-		Format.Block.Indent = False
-		Format.Decl.Property.LeadingSpace = False
-		Format.Decl.Value.LeadingSpace = False
-		Format.Decl.LastSemi = False
-		Format.Decl.OnePerLine = False
+		stats.sample('format.stack_depth', len(Format.Stack))
+		Format.set(MINIFY)
 	@staticmethod
 	def pop():
 		# NOTE: intentionally raise exception if none were pushed
@@ -151,15 +256,96 @@ class Format:
 			return None
 		else:
 			last = Format.Stack[-1]
-			if last == 'canonical':
-				Format.canonical()
-			elif last == 'minify':
-				Format.minify()
+			Format.set(CANONICAL if last == 'canonical' else MINIFY)
 			return last
+	@staticmethod
+	def set(opts):
+		Format.Minify = opts.minify
+		Format.Spec.OpSpace = opts.op_space
+		Format.Block.Indent = opts.block_indent
+		Format.Decl.Property.LeadingSpace = opts.property_leading_space
+		Format.Decl.Value.LeadingSpace = opts.value_leading_space
+		Format.Decl.LastSemi = opts.last_semi
+		Format.Decl.OnePerLine = opts.one_per_line
+
+# every Decl gets a fresh number when built or changed, so a tuple of
+# them identifies a block's exact contents; see Decls.stamp()
+_revs = count(1)
+
+def _intern(s):
+	"""share one copy of a node key; every node compares and hashes by
+	its key, so equal keys are usually the same object"""
+	return intern(s) if type(s) is str else s
 
 # strip whitespace and comments
 def filter_space(l): return filter(lambda c: c.tag not in ('s','comment'), l)
 
+# what toplevel_chunks() looks for next, by state
+_CHUNK_SCAN = {
+	'top'     : re.compile(r'/\*|["\'(){};]').search,
+	'paren'   : re.compile(r'["\'()]').search,
+	'comment' : re.compile(r'\*/').search,
+	'"'       : re.compile(r'\\[\s\S]|"').search,
+	"'"       : re.compile(r"'").search,
+}
+
+def toplevel_chunks(f, chunksize=65536):
+	"""
+	read CSS from file object f and yield runs of text that end on a
+	top-level boundary: a '}' closing depth 0 or a depth-0 ';'. tracks
+	strings, comments and parentheses so braces inside them don't count
+	"""
+	buf = ''
+	pos = 0       # where scanning resumes
+	depth = 0     # '{' nesting
+	paren = 0     # '(' nesting; braces and comments don't apply inside
+	state = 'top' # or 'paren', 'comment', '"', "'"
+	eof = False
+	while not eof:
+		data = f.read(chunksize)
+		eof = not data
+		buf += data
+		# hold back the last char until we've seen the next one, so
+		# two-character tokens ('/*', '*/', escapes) aren't split
+		limit = len(buf) if eof else len(buf) - 1
+		cut = 0
+		while True:
+			m = _CHUNK_SCAN[state](buf, pos, limit)
+			if not m:
+				pos = max(pos, limit - 1, 0)
+				break
+			pos = m.end()
+			tok = m.group()
+			if state == 'comment':
+				state = 'top'
+			elif state in ('"', "'"):
+				if tok == state:
+					state = 'paren' if paren else 'top'
+			elif tok in ('"', "'"):
+				state = tok
+			elif tok == '/*':
+				state = 'comment'
+			elif tok == '(':
+				paren += 1
+				state = 'paren'
+			elif tok == ')':
+				paren = max(0, paren - 1)
+				state = 'paren' if paren else 'top'
+			elif tok == '{':
+				depth += 1
+			elif tok == '}':
+				depth = max(0, depth - 1)
+				if not depth:
+					cut = pos
+			elif tok == ';' and not depth:
+				cut = pos
+		if cut:
+			yield buf[:cut]
+			buf = buf[cut:]
+			pos -= cut
+	if buf:
+		yield buf
+
 def first_index(lst, pred):
     for i,v in enumerate(lst):
         if pred(v):
@@ -167,15 +353,26 @@ def first_index(lst, pred):
     return None
 
 class CSSDoc:
-	Parser = Parser(CSS_EBNF)
+	Parser = EBNFParser(CSS_EBNF)
+	# parse engines by name; both produce identical parse trees
+	Parsers = {
+		'ebnf' : Parser,
+		'fast' : fastparse.Parser(),
+	}
+	Engine = 'fast'
+	# drop parse tree references once the model is built
+	Lean = False
 	def __init__(self, ast):
 		self.ast = ast
 		#print 'CSSDoc ast:', ast
+		self.interned = Interner()
 		self.top = []
 		for a in ast:
 			#print 'a.child:', a.child
 			if a.child[0].tag == 'rule':
 				t = TopLevel(a.child[0])
+				# as we go, so duplicates never pile up
+				self.interned.block(t.contents.decls)
 				self.top.append(t)
 			elif a.child[0].tag == 's':
 				for s in a.child[0].child:
@@ -190,31 +387,101 @@ class CSSDoc:
 			elif isinstance(t.contents, AtRule):
 				self.atrules.append(t.contents)
 	def __repr__(self): return ','.join(map(str, self.top))
-	def format(self):
-		nl = '' if Format.Minify else '\n'
-		s = ''
-		for t in self.top:
-			if isinstance(t.contents, Comment) and Format.Minify and \
-				(t.contents.text == '' or '\\' in t.contents.text):
+	def format(self, opts=None):
+		stats.sample('format.stack_depth', len(Format.Stack))
+		with stats.timer('format'):
+			return ''.join(CSSDoc.format_stream((t.contents for t in self.top), opts))
+	@staticmethod
+	def format_stream(items, opts=None):
+		"""
+		format top-level items, yielding output as soon as it's known;
+		the pieces join to exactly what CSSDoc.format() returns
+		"""
+		opts = opts or Format.current()
+		nl = '' if opts.minify else '\n'
+		started = False
+		pending = '' # whitespace that is only output if more follows
+		for c in items:
+			if isinstance(c, Comment) and opts.minify and \
+				(c.text == '' or '\\' in c.text):
 				# assume browser-specific hack, preserve
 				# see: test/minify/hack-ie5-mac-backslash.css
-				txt = t.contents.text
-				s += '/*' + txt[max(0, txt.find('\\')):] + '*/'
+				txt = c.text
+				s = '/*' + txt[max(0, txt.find('\\')):] + '*/'
 			else:
-				s += t.format() + nl
-		return s.strip()
+				s = c.format(opts) + nl
+			s = pending + s
+			if not started:
+				s = s.lstrip()
+			body = s.rstrip()
+			pending = s[len(body):]
+			if body:
+				started = True
+				yield body
 	@staticmethod
-	def parse(text):
+	def iterparse(f, parser=None, chunksize=65536):
+		"""
+		parse a file object incrementally, yielding each top-level
+		Rule, AtRule, Comment and Whitespace as its input is complete;
+		memory use is bounded by the largest rule, not the file
+		"""
+		for text in toplevel_chunks(f, chunksize):
+			doc = CSSDoc.parse(text, parser, lean=True)
+			for t in doc.top:
+				yield t.contents
+	@staticmethod
+	def parse(text, parser=None, lean=None):
+		"""parse text with the named engine, 'fast' or 'ebnf';
+		lean=True releases the parse tree as soon as the model is built"""
+		child = CSSDoc.parse_tree(text, parser)
+		memory.checkpoint('parse.tree')
+		# the AST and the model are large and acyclic, like the parse
+		# tree; collecting while building them only burns time
+		enabled = gc.isenabled()
+		gc.disable()
+		try:
+			with stats.timer('parse.ast'):
+				ast = AstNode.make(child, text)
+			memory.checkpoint('parse.ast')
+			with stats.timer('parse.model'):
+				doc = CSSDoc(ast)
+			memory.checkpoint('parse.model')
+		finally:
+			if enabled:
+				gc.enable()
+		if CSSDoc.Lean if lean is None else lean:
+			with stats.timer('parse.release'):
+				doc.release_ast()
+			memory.checkpoint('parse.release')
+		if stats.Enabled:
+			stats.count('parse.rules', len(doc.rules))
+			stats.count('parse.decls', sum(len(r.decls.decl) for r in doc.rules))
+		return doc
+	@staticmethod
+	def parse_tree(text, parser=None):
+		"""the raw (tag, start, end, children) parse of all of text"""
 		prod = 'css'
-		ok, child, nextchar = CSSDoc.Parser.parse(text, production=prod)
+		engine = CSSDoc.Parsers[parser or CSSDoc.Engine]
+		with stats.timer('parse.tree'):
+			ok, child, nextchar = engine.parse(text, production=prod)
+		stats.count('parse.bytes', len(text))
 		if not ok or nextchar != len(text):
 			lineno = text[:nextchar].count('\n')
 			line = text[:nextchar+256].split('\n')[lineno]
 			raise Exception("""Line %u: %s\n\tparse error: "%s..." """ % (
 				lineno, line, repr(text[nextchar:nextchar+256])))
-		ast = AstNode.make(child, text)
-		doc = CSSDoc(ast)
-		return doc
+		return child
+	def release_ast(self):
+		"""
+		forget the parse tree; every model object has already copied
+		out what it needs, and only the document and its top-level
+		items keep their node, so this lets the whole tree be collected
+		"""
+		self.ast = None
+		for t in self.top:
+			t.ast = None
+		for a in self.atrules:
+			a.ast = None
 
 class TopLevel:
 	def __init__(self, ast):
@@ -233,18 +500,22 @@ class TopLevel:
 			return AtRule.from_ast(ast)
 		else:
 			return Whitespace.from_ast(ast)
-	def format(self):
-		return self.contents.format()
+	def format(self, opts=None):
+		return self.contents.format(opts)
 
 class AtRule:
 	def __init__(self, ast, keyword, vals):
 		self.ast = ast
 		self.keyword = keyword
 		self.vals = vals
-	def __repr__(self): return 'AtRule(%s)' % str(self.ast)
-	def format(self):
-		return self.keyword.format() + ' ' + \
-			' '.join([v.format() for v in self.vals]) + \
+	def __repr__(self):
+		if self.ast:
+			return 'AtRule(%s)' % str(self.ast)
+		return 'AtRule(%s,%s)' % (self.keyword, self.vals)
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		return self.keyword.format(opts) + ' ' + \
+			' '.join([v.format(opts) for v in self.vals]) + \
 			(';' if not isinstance(self.vals[-1], Decls) else '')
 	@staticmethod
 	def from_ast(ast):
@@ -263,11 +534,12 @@ class Rule:
 		self.decls = decls
 	def __repr__(self):
 		return 'Rule(%s,%s)' % (self.sels, self.decls)
-	def format(self):
-		selstr = self.sels.format()
-		if selstr and not Format.Minify:
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		selstr = self.sels.format(opts)
+		if selstr and not opts.minify:
 			selstr += ' '
-		return selstr + self.decls.format()
+		return selstr + self.decls.format(opts)
 	@staticmethod
 	def from_ast(ast):
 		if ast.child[0].tag == 'sels':
@@ -282,8 +554,9 @@ class Comment:
 		self.text = text
 	def __repr__(self):
 		return 'Comment(%s)' % self.text
-	def format(self, preserve=False):
-		return '/*' + self.text + '*/' if preserve or not Format.Minify or self.text.endswith('/*') else ''
+	def format(self, opts=None, preserve=False):
+		opts = opts or Format.current()
+		return '/*' + self.text + '*/' if preserve or not opts.minify or self.text.endswith('/*') else ''
 	@staticmethod
 	def from_ast(ast):
 		return Comment(ast.child[0].str)
@@ -293,12 +566,13 @@ class Whitespace:
 		self.s = s
 	def __repr__(self):
 		return 'Whitespace(%s)' % repr(self.s)
-	def format(self, forceshow=False):
+	def format(self, opts=None, forceshow=False):
 		if forceshow:
 			return self.s
-		if Format.Minify:
+		opts = opts or Format.current()
+		if opts.minify:
 			return ''
-		if not Format.Unmodified and self.s.count('\n') > 1:
+		if not opts.unmodified and self.s.count('\n') > 1:
 			return '\n'
 		return self.s
 	@staticmethod
@@ -313,9 +587,10 @@ class Sels:
 		return 'Sels(' + ','.join(map(str,self.sel)) + ')'
 	def __len__(self):
 		return sum(map(len, self.sel))
-	def format(self):
-		j = ',' + (' ' if not Format.Minify else '')
-		return j.join(s.format() for s in self.sel)
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		j = ',' + (' ' if not opts.minify else '')
+		return j.join(s.format(opts) for s in self.sel)
 	@staticmethod
 	def from_ast(ast):
 		sel = map(Sel.from_ast, filter_space(ast.child))
@@ -328,19 +603,25 @@ class Sels:
 class Sel:
 	def __init__(self, sel):
 		#print 'Sel ast:', ast
-		self.sel = sorted(sel)
+		# order is significant: "a b" is not "b a"
+		self.sel = list(sel)
 		#print 'Sel.sel:', self.sel
-		# FIXME: this is hideous
-		Format.minify()
-		f = self.format()
-		Format.pop()
-		self._len = len(f)
+		self._fmt = {}
+		self._len = len(self.format(MINIFY))
+		self.key = _intern('Sel(' + ','.join(map(str,self.sel)) + ')')
 	def __repr__(self):
-		return 'Sel(' + ','.join(map(str,self.sel)) + ')'
-	def format(self):
-		s = ''.join(s.format() for s in self.sel[0])
+		return self.key
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		try:
+			return self._fmt[opts]
+		except KeyError:
+			s = self._fmt[opts] = self._format(opts)
+			return s
+	def _format(self, opts):
+		s = ''.join(s.format(opts) for s in self.sel[0])
 		for sel in self.sel[1:]:
-			s2 = ''.join(s.format() for s in sel)
+			s2 = ''.join(s.format(opts) for s in sel)
 			if sel[0].op in (Sel_Op.TAG, Sel_Op.CLASS, Sel_Op.ID):
 				# spaces only matter for these operators; the
 				# rest can be omitted with no difference
@@ -363,9 +644,9 @@ class Sel:
 		#print 'Sel.from_ast skip_tagop:', skip_tagop
 		return map(Sel_Op, ast.child)
 	def __hash__(self):
-		return hash(str(self))
+		return hash(self.key)
 	def __cmp__(self, other):
-		return cmp(str(self), str(other))
+		return cmp(self.key, getattr(other, 'key', other))
 
 class Sel_Op:
 	TAG    = 1
@@ -376,7 +657,6 @@ class Sel_Op:
 	ADJ    = 6
 	ATTR   = 7
 	def __init__(self, ast):
-		self.ast = ast
 		c = ast.child[0]
 		self.tag = c.tag
 		if c.tag == 'sel_tag':		self.op = Sel_Op.TAG
@@ -391,54 +671,90 @@ class Sel_Op:
 		self.s = args[0].child[0].str
 		self.sel_op = None
 		self.operand = None
+		self.hack = False
+		self._fmt = {}
+		if self.op == Sel_Op.CHILD:
+			try:
+				h = c.child[0].child[0]
+				if h.tag == 'comment' and h.str == '/**/':
+					# child selector hack, preserve comment
+					# see test/minify/hack-ie-child-selector.css
+					self.hack = True
+			except IndexError:
+				pass
 		if len(args) > 1:
 			self.sel_op = args[1].str
 			self.operand = Value.from_ast(args[2])
 		#print 'Sel_Op self.s:', self.s
 	def __repr__(self):
-		return 'Sel_Op(%s)' % self.format()
-	def format(self):
+		return 'Sel_Op(%s)' % self.format(CANONICAL)
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		try:
+			return self._fmt[opts]
+		except KeyError:
+			s = self._fmt[opts] = self._format(opts)
+			return s
+	def _format(self, opts):
 		s = self.s
-		sp = '' if Format.Minify else ' '
+		sp = '' if opts.minify else ' '
 		if self.op == Sel_Op.TAG:	s =        s
 		elif self.op == Sel_Op.CLASS:	s = '.'  + s
 		elif self.op == Sel_Op.ID:	s = '#'  + s
 		elif self.op == Sel_Op.PSUEDO:	s = ':'  + s
 		elif self.op == Sel_Op.CHILD:
 			s = '>'
-			try:
-				c = self.ast.child[0].child[0].child[0]
-				if c.tag == 'comment' and c.str == '/**/':
-					# child selector hack, preserve comment
-					# see test/minify/hack-ie-child-selector.css
-					s += '/**/'
-			except:
-				pass
+			if self.hack:
+				s += '/**/'
 			s += sp + self.s
 		elif self.op == Sel_Op.ADJ:	s = '+' + sp + s
 		elif self.op == Sel_Op.ATTR:
 			if self.sel_op:
-				s += str(self.sel_op) + str(self.operand)
+				s += self.sel_op + self.operand.format(opts)
 			s = '[' + s + ']'
 		return s
 
 class Decls:
 	def __init__(self, decl):
 		self.decl = list(decl)
+		# format mode -> (stamp, formatted); checked against stamp() since
+		# self.decl and its members are edited in place by refactoring
+		self._fmt = {}
+		self._key = (None, None)
 	def __repr__(self):
 		return 'Decls(' + ','.join(map(str,self.decl)) + ')'
-	def format(self):
-		nd = Format.Indent.Char if Format.Block.Indent else ''
-		nl = '\n' if Format.Block.Indent else ''
+	def stamp(self):
+		"""identifies the current contents of self.decl"""
+		return tuple(d._rev for d in self.decl)
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		stamp = self.stamp()
+		cached = self._fmt.get(opts)
+		if cached and cached[0] == stamp:
+			return cached[1]
+		s = self._format(opts)
+		self._fmt[opts] = (stamp, s)
+		return s
+	@property
+	def key(self):
+		"""the declarations' keys, in sorted order"""
+		stamp = self.stamp()
+		if self._key[0] != stamp:
+			self._key = (stamp, _intern(
+				'{' + ';'.join(sorted(d.key for d in self.decl)) + '}'))
+		return self._key[1]
+	def _format(self, opts):
+		nd = opts.indent_char if opts.block_indent else ''
+		nl = '\n' if opts.block_indent else ''
 		le = ';' + nl
 		return '{' + nl + \
-			((le.join(nd + d.format() for d in self.decl) +
-			 (';' if (not isinstance(self.decl[-1].values[0], Decls)) and Format.Decl.LastSemi and not Format.Minify else '') + nl) \
+			((le.join(nd + d.format(opts) for d in self.decl) +
+			 (';' if (not isinstance(self.decl[-1].values[0], Decls)) and opts.last_semi and not opts.minify else '') + nl) \
 				if self.decl else '') + '}'
 	def __hash__(self):
-		return hash(str(sorted(self.decl)))
+		return hash(self.key)
 	def __cmp__(self, other):
-		return cmp(str(sorted(self.decl)), str(sorted(other.decl)))
+		return cmp(self.key, getattr(other, 'key', other))
 	@staticmethod
 	def from_ast(ast):
 		"""build Decls() from an AstNode"""
@@ -453,44 +769,72 @@ class Decls:
 		return Decls(self.decl + other.decl)
 
 class Decl:
-	def __init__(self, property_, values, ast=None, post_prop_s='', pre_vals_s=''):
-		self.ast = ast
+	# assigning any of these changes format(), so drops cached output
+	FORMATTED = frozenset(('property', 'values', 'post_prop_s', 'pre_vals_s'))
+	def __init__(self, property_, values, post_prop_s='', pre_vals_s=''):
+		self.id = None # see Interner
 		#print 'Decl ast:', ast
 		self.property = property_
-		self.propertylow = self.property.lower()
 		self.post_prop_s = post_prop_s if post_prop_s else Whitespace('')
 		self.pre_vals_s = pre_vals_s if pre_vals_s else Whitespace('')
 		self.values = values
-		self._str = None
+	def __setattr__(self, name, value):
+		self.__dict__[name] = value
+		if name in Decl.FORMATTED:
+			if name == 'property':
+				self.__dict__['propertylow'] = value.lower()
+			self.__dict__['_rev'] = next(_revs)
+			self.__dict__['_fmt'] = {}
+			self.__dict__['_str'] = None
+			self.__dict__['_len'] = None
+			self.__dict__['_key'] = None
+			self.__dict__['id'] = None
+	@property
+	def key(self):
+		"""lowercased property and value keys; whitespace is ignored"""
+		if self._key is None:
+			self._key = _intern(self.propertylow + ':' +
+				','.join(v.key for v in self.values))
+		return self._key
 	def __repr__(self):
 		if not self._str:
 			self._str = 'Decl(%s:%s)' % (self.property, self.values)
 		return self._str
 	def __len__(self):
-		return len(self.property.format()) + \
-			sum(len(v.format())+2 for v in self.values) - 1
-	def format(self):
+		if self._len is None:
+			self._len = len(self.property) + \
+				sum(len(v.format(MINIFY))+2 for v in self.values) - 1
+		return self._len
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		try:
+			return self._fmt[opts]
+		except KeyError:
+			s = self._fmt[opts] = self._format(opts)
+			return s
+	def _format(self, opts):
 		# decl values need spaces between them even in Minify, with a few exceptions
-		valstr = self.values[0].format()
+		valstr = self.values[0].format(opts)
 		prevNoSpace = False # set by values to tell next one it doesn't need a space
 		prev = None
 		for v in self.values[1:]:
 			# the rules for required inter-value spaces are a little tricky
-			currNoSpace = isinstance(v, Delim) and (Format.Minify or not v.leading_space())
+			currNoSpace = isinstance(v, Delim) and (opts.minify or not v.leading_space())
 			prevNoSpace = prev and \
-				((Format.Minify and \
+				((opts.minify and \
 					(isinstance(prev, Uri) or isinstance(prev, Delim)))
 				 or (isinstance(prev, Delim) and not prev.trailing_space()))
 			sp = '' if currNoSpace or prevNoSpace else ' '
-			valstr += sp + v.format()
+			valstr += sp + v.format(opts)
 			prev = v
-		return self.property + self.post_prop_s.format(True) + ':' + \
-			self.pre_vals_s.format(True) + \
-			(' ' if Format.Decl.Value.LeadingSpace else '') + valstr
-	def __eq__(self, other):
-		return self.propertylow == other.property and self.values == other.values
-	def __hash__(self): return hash(str(self.propertylow))
-	def __cmp__(self, other): return cmp(str(self), str(other))
+		return self.property + self.post_prop_s.format(forceshow=True) + ':' + \
+			self.pre_vals_s.format(forceshow=True) + \
+			(' ' if opts.value_leading_space else '') + valstr
+	def ikey(self):
+		"""key plus what format() shows that key ignores"""
+		return (self.key, self.property, self.post_prop_s.s, self.pre_vals_s.s)
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 	@staticmethod
 	def from_ast(ast):
 		"""generate a Decl from an AstNode"""
@@ -509,7 +853,7 @@ class Decl:
 		if vals_idx == col_idx+2 and c[col_idx+1].child:
 			pre_vals_s = Whitespace(c[col_idx+1].str.strip())
 		prop = ast.child[0]
-		d = Decl(prop.str, [], ast, post_prop_s, pre_vals_s)
+		d = Decl(prop.str, [], post_prop_s, pre_vals_s)
 		d.values = map(Value.from_ast, filter_space(c[vals_idx].child))
 		return d
 
@@ -543,10 +887,13 @@ class Value:
 		return ast
 
 class Ident(object):
-	def __init__(self, s): self.s = s
-	def __repr__(self): return 'Ident(%s)' % self.s
-	def format(self): return self.s
-	def __cmp__(self, other): return cmp(str(self), str(other))
+	def __init__(self, s):
+		self.s = s
+		self.key = _intern('Ident(%s)' % s)
+	def __repr__(self): return self.key
+	def format(self, opts=None): return self.s
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 	@staticmethod
 	def from_ast(ast): return Ident(ast.str)
 
@@ -554,57 +901,69 @@ class Number:
 	def __init__(self, ast):
 		self.s = ast.child[0].str
 		self.f = float(self.s)
-	def __repr__(self): return 'Number(%s)' % self.s
-	def format(self): return self.s
-	def __cmp__(self, other): return cmp(str(self), str(other))
+		self.key = _intern('Number(%s)' % self.s)
+	def __repr__(self): return self.key
+	def format(self, opts=None): return self.s
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 
 class Percent:
 	def __init__(self, ast):
 		self.s = ast.child[0].str
 		self.f = float(self.s)
-	def __repr__(self): return 'Percent(%s%%)' % self.s
-	def format(self):
+		self.key = _intern('Percent(%s%%)' % self.s)
+	def __repr__(self): return self.key
+	def format(self, opts=None):
+		opts = opts or Format.current()
 		unit = '%'
-		if Format.Minify and self.s == '0':
+		if opts.minify and self.s == '0':
 			unit = ''
 		return self.s + unit
-	def __cmp__(self, other): return cmp(str(self), str(other))
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 
 class Dimension:
 	def __init__(self, ast):
-		self.ast = ast
 		n = ast.child[0]
 		self.num = Number(n)
 		u = ast.child[1] if len(ast.child) > 1 else ''
 		self.unit = Ident.from_ast(u.child[0])
-	def __repr__(self): return 'Dimension(%s,%s)' % (self.num, self.unit)
-	def format(self):
-		nf = self.num.format()
-		uf = self.unit.format()
+		self.key = _intern('Dimension(%s,%s)' % (self.num, self.unit))
+	def __repr__(self): return self.key
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		nf = self.num.format(opts)
+		uf = self.unit.format(opts)
 		# "After the '0' length, the unit identifier is optional."
 		# Ref: http://www.w3.org/TR/css3-values/#lengths
-		if Format.Minify and nf == '0':
+		if opts.minify and nf == '0':
 			uf = ''
 		return nf + uf
-	def __cmp__(self, other): return cmp(str(self), str(other))
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 
 class String:
 	def __init__(self, ast, q):
 		self.q = q
 		self.s = ast.child[0].str
-	def __repr__(self): return self.q + self.s + self.q
-	def format(self): return self.q + self.s + self.q
-	def __cmp__(self, other): return cmp(str(self), str(other))
+		self.key = _intern(q + self.s + q)
+	def __repr__(self): return self.key
+	def format(self, opts=None): return self.q + self.s + self.q
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 
 class Delim:
-	def __init__(self, s): self.s = s
-	def __repr__(self): return 'Delim(%s)' % self.s
-	def format(self): return self.s
+	def __init__(self, s):
+		self.s = s
+		self.key = _intern('Delim(%s)' % s)
+	def __repr__(self): return self.key
+	def format(self, opts=None): return self.s
 	def leading_space(self):
 		return self.s in ('!',)
 	def trailing_space(self):
 		return self.s in (',',)
-	def __cmp__(self, other): return cmp(str(self), str(other))
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 	@staticmethod
 	def from_ast(ast):
 		return Delim(ast.str)
@@ -612,9 +971,11 @@ class Delim:
 class Hash:
 	def __init__(self, ast):
 		self.color = Color(ast.str)
-	def __repr__(self): return 'Hash(%s)' % self.color
-	def format(self): return self.color.format()
-	def __cmp__(self, other): return cmp(str(self), str(other))
+		self.key = _intern('Hash(%s)' % self.color)
+	def __repr__(self): return self.key
+	def format(self, opts=None): return self.color.format(opts)
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 
 class Color:
 	# Ref: http://www.w3.org/TR/CSS2/syndata.html#color-units
@@ -659,37 +1020,87 @@ class Color:
 					name = s
 		self.canonical = name if name else rgb6 if rgb6 else s
 		self.shortest = name if name and len(name) < 4 else rgb3 if rgb3 else name
+		self.key = _intern('Color(%s)' % self.canonical)
 	def __repr__(self):
-		return 'Color(%s)' % self.canonical
-	def format(self):
-		return self.shortest if Format.Minify else self.canonical
-	def __cmp__(self, other): return cmp(str(self), str(other))
+		return self.key
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		return self.shortest if opts.minify else self.canonical
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 
 class Expression:
-	def __init__(self, ast): self.s = ast.str
-	def __repr__(self): return 'Expression(%s)' % self.s
-	def format(self): return self.s
-	def __cmp__(self, other): return cmp(str(self), str(other))
+	def __init__(self, ast):
+		self.s = ast.str
+		self.key = _intern('Expression(%s)' % self.s)
+	def __repr__(self): return self.key
+	def format(self, opts=None): return self.s
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 
 class Uri:
 	def __init__(self, ast):
-		self.ast = ast
-		self.s = ast.child[0].child[0].child[0]
-	def __repr__(self): return 'Uri(%s)' % self.s
-	def format(self):
-		url = self.s.str
-		if Format.Minify \
-			and self.s.tag in ('string','sqstring') \
+		u = ast.child[0].child[0].child[0]
+		self.tag = u.tag
+		self.s = u.str
+		self.key = _intern('Uri(%s)' % repr(self.s))
+	def __repr__(self): return self.key
+	def format(self, opts=None):
+		opts = opts or Format.current()
+		url = self.s
+		if opts.minify \
+			and self.tag in ('string','sqstring') \
 			and url.find(')') == -1:
 			url = url[1:-1]
 		return 'url(%s)'  % url
-	def __cmp__(self, other): return cmp(str(self), str(other))
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
 
 class Filter:
-	def __init__(self, ast): self.s = ast.str
-	def __repr__(self): return 'Filter(%s)' % self.s
-	def format(self): return self.s
-	def __cmp__(self, other): return cmp(str(self), str(other))
+	def __init__(self, ast):
+		self.s = ast.str
+		self.key = _intern('Filter(%s)' % self.s)
+	def __repr__(self): return self.key
+	def format(self, opts=None): return self.s
+	def __hash__(self): return hash(self.key)
+	def __cmp__(self, other): return cmp(self.key, getattr(other, 'key', other))
+
+class Interner:
+	"""
+	a document's table of shared model objects: equal values, and Decls
+	that format identically, become a single instance. Each interned
+	Decl also gets an id, a small int shared by all Decls with the same
+	key, so sets of them can be handled as sets of ints.
+	Interned objects are shared; replace them, don't modify them.
+	"""
+	def __init__(self):
+		self.values = {}
+		self.decls = {}
+		self.ids = {}
+		self.byid = [] # id -> first Decl seen with that key
+	def value(self, v):
+		if isinstance(v, Decls):
+			self.block(v)
+			return v
+		return self.values.setdefault(v.key, v)
+	def decl(self, d):
+		if d.id is not None and self.decls.get(d.ikey()) is d:
+			return d
+		d.values = map(self.value, d.values)
+		k = d.ikey()
+		try:
+			return self.decls[k]
+		except KeyError:
+			pass
+		d.id = self.ids.get(d.key)
+		if d.id is None:
+			d.id = self.ids[d.key] = len(self.byid)
+			self.byid.append(d)
+		self.decls[k] = d
+		return d
+	def block(self, decls):
+		decls.decl = map(self.decl, decls.decl)
+		return decls
 
 # Ref: http://code.activestate.com/recipes/65287-automatically-start-the-debugger-on-an-exception/
 def info(type, value, tb):
@@ -796,3 +1207,18 @@ o very long title"] {/*...*/}''',
 
 	print 'Tests passed (%u/%u)' % (passed, len(CSS_TESTS))
 
+	print 'Comparing parsers...'
+
+	same = 0
+	for t in CSS_TESTS:
+		ebnf = CSSDoc.Parsers['ebnf'].parse(t, production='css')
+		fast = CSSDoc.Parsers['fast'].parse(t, production='css')
+		if ebnf == fast:
+			same += 1
+		else:
+			print t
+			print 'ebnf:', ebnf
+			print 'fast:', fast
+
+	print 'Parse trees identical (%u/%u)' % (same, len(CSS_TESTS))
+
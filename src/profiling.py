@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Whole-run profiles, for --profile
+
+Two ways to record one:
+
+	trace	cProfile: every call, with exact counts, but each call is
+		slower, which skews long aggressive runs
+	sample	the stack every interval of CPU time (SIGPROF), for
+		little overhead; "calls" are then samples, and each is
+		worth the CPU time measured since the one before, since
+		the kernel delivers them no faster than its tick and
+		merges those that arrive together
+
+Either way PATH gets a pstats file (python -m pstats PATH, gprof2dot,
+snakeviz) and PATH.folded the same as collapsed stacks, one
+"f;g;h count" line per stack, for flamegraph.pl or speedscope. Counts
+are microseconds. Samples give whole stacks; a trace keeps only
+caller-callee edges, so its stacks are made up by splitting each
+function's time among its callers in proportion.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import os
+import signal
+import marshal
+import resource
+from collections import defaultdict
+
+class Profile(object):
+	"""
+	profile from start() to stop(), which writes path and path.folded;
+	sample is the seconds of CPU between samples, or None to trace
+	"""
+	# a made-up trace stack's share of the run below which it is
+	# folded into its caller's line
+	Resolution = 1e-4
+	def __init__(self, path, sample=None):
+		self.path = path
+		self.sample = sample
+		# stack -> [samples, seconds]
+		self.stacks = defaultdict(lambda: [0, 0.0])
+	def start(self):
+		if self.sample:
+			self.cpu = cpu()
+			signal.signal(signal.SIGPROF, self.sampled)
+			# a sample mustn't fail a read or write with EINTR
+			signal.siginterrupt(signal.SIGPROF, False)
+			signal.setitimer(signal.ITIMER_PROF, self.sample, self.sample)
+		else:
+			import cProfile
+			self.profiler = cProfile.Profile()
+			self.profiler.enable()
+		return self
+	def stop(self):
+		if self.sample:
+			signal.setitimer(signal.ITIMER_PROF, 0)
+			signal.signal(signal.SIGPROF, signal.SIG_DFL)
+			stats = sample_stats(self.stacks)
+			folded = dict((s, int(t * 1e6))
+				for s, (n, t) in self.stacks.iteritems())
+		else:
+			self.profiler.disable()
+			self.profiler.create_stats()
+			stats = self.profiler.stats
+			folded = trace_stacks(stats, self.Resolution)
+		f = open(self.path, 'wb')
+		marshal.dump(stats, f)
+		f.close()
+		f = open(self.path + '.folded', 'w')
+		for stack, n in sorted(folded.iteritems()):
+			if n > 0:
+				f.write('%s %u\n' % (';'.join(map(label, stack)), n))
+		f.close()
+	def sampled(self, signum, frame):
+		stack = []
+		while frame is not None:
+			c = frame.f_code
+			stack.append((c.co_filename, c.co_firstlineno, c.co_name))
+			frame = frame.f_back
+		stack.reverse()
+		now = cpu()
+		e = self.stacks[tuple(stack)]
+		e[0] += 1
+		e[1] += now - self.cpu
+		self.cpu = now
+
+def cpu():
+	"""seconds of CPU this process has used"""
+	r = resource.getrusage(resource.RUSAGE_SELF)
+	return r.ru_utime + r.ru_stime
+
+def label(func):
+	"""a pstats function key as a stack frame's name"""
+	filename, line, name = func
+	if filename == '~':
+		return name # a builtin
+	return '%s (%s:%u)' % (name, os.path.basename(filename), line)
+
+def sample_stats(stacks):
+	"""
+	pstats' dict of sampled stacks, {stack: (samples, seconds)}: each
+	function's calls are the samples it was on the stack in, its own
+	time the seconds of those it was on top in
+	"""
+	# func -> [cc, nc, tt, ct, {caller: [cc, nc, tt, ct]}]
+	out = {}
+	def entry(d, f):
+		e = d.get(f)
+		if e is None:
+			e = d[f] = [0, 0, 0.0, 0.0]
+		return e
+	callers = defaultdict(dict)
+	for stack, (n, t) in stacks.iteritems():
+		seen = set()
+		for i, f in enumerate(stack):
+			top = i == len(stack) - 1
+			e = entry(out, f)
+			if f not in seen:
+				# a function in a stack twice is there once by time
+				seen.add(f)
+				e[0] += n
+				e[1] += n
+				e[3] += t
+			if top:
+				e[2] += t
+			if i:
+				c = entry(callers[f], stack[i - 1])
+				c[0] += n
+				c[1] += n
+				c[2] += t if top else 0.0
+				c[3] += t
+	return dict((f, tuple(e) + (dict((c, tuple(v))
+			for c, v in callers[f].iteritems()),))
+		for f, e in out.iteritems())
+
+def trace_stacks(stats, resolution=Profile.Resolution):
+	"""
+	{stack: microseconds} made up from pstats' dict: from each function
+	no profiled function called, its time is split among what it
+	called by the time spent in each call from it, down to stacks
+	under resolution of the run's total
+	"""
+	callees = defaultdict(list)
+	roots = []
+	for f, (cc, nc, tt, ct, callers) in stats.iteritems():
+		if not callers:
+			roots.append(f)
+		for c, edge in callers.iteritems():
+			callees[c].append((f, edge[3]))
+	total = sum(stats[f][3] for f in roots)
+	least = total * resolution
+	out = defaultdict(int)
+	def fold(stack, f, t):
+		ct = stats[f][3]
+		own = t
+		for g, edge_ct in callees[f]:
+			if g in stack:
+				continue # recursion; its time is in this call's
+			share = t * min(1.0, edge_ct / ct) if ct else 0.0
+			if share < least:
+				continue
+			own -= share
+			fold(stack + (g,), g, share)
+		out[stack] += int(max(own, 0.0) * 1e6)
+	for f in roots:
+		fold((f,), f, stats[f][3])
+	return out
+
+def start(path, sample=None):
+	"""a started Profile; sample is its interval in seconds, or None to trace"""
+	return Profile(path, sample).start()
@@ -12,15 +12,46 @@ then, merge any 2+ sub-properties into their common parent
 """
 
 import sys
-from itertools import chain, combinations
+from itertools import chain, islice, izip
+from time import time
+from heapq import heappush, heappop
 from collections import defaultdict
 from optparse import OptionParser
 
 import parse as cssparse
-from parse import Rule, Sels, Decls, Decl, Ident, Delim
+import stats
+import memory
+from itemsets import fpgrowth
+from minhash import LSH
+# incidence.py, once matrix() wants it: NumPy takes longer to import
+# than most sheets take to refactor. False if there's no NumPy; the
+# pure Python path does the same
+incidence = None
+from parse import Rule, Sels, Decls, Decl, Ident, Delim, CANONICAL
 
 def flatten(l): return list(chain.from_iterable(l))
 
+def bitmask(ids):
+	"""an int with bit i set for each i in ids"""
+	m = 0
+	for i in ids:
+		m |= 1 << i
+	return m
+
+def bits(m):
+	"""the positions of the bits set in int m, lowest first"""
+	out = []
+	while m:
+		low = m & -m
+		out.append(low.bit_length() - 1)
+		m ^= low
+	return out
+
+def unique(l):
+	"""l without repeats, in order of first appearance"""
+	seen = set()
+	return [x for x in l if not (x in seen or seen.add(x))]
+
 # css string sort: # '@' < '*' < [a-zA-Z_] < '#' < '.' < '-'
 # Unicode code points are within 'the range of integers from 0 to 0x10FFFF.'
 # Ref: http://unicode.org/glossary/#code_point
@@ -31,13 +62,14 @@ FIRSTCHAR = {
 	'*' : -1,
 	'@' : -2,
 }
+def css_sortkey(x):
+	"""sort key ordering strings by FIRSTCHAR, then as usual"""
+	if not x:
+		return (-3, x)
+	return (FIRSTCHAR.get(x[0], ord(x[0])), x)
+
 def css_strcmp(x, y):
-	if x and y:
-		x0 = FIRSTCHAR.get(x[0], ord(x[0]))
-		y0 = FIRSTCHAR.get(y[0], ord(y[0]))
-		if x0 != y0:
-			return x0 - y0
-	return cmp(x, y)
+	return cmp(css_sortkey(x), css_sortkey(y))
 
 class Inherit_(Ident):
 	def __init__(self):
@@ -177,138 +209,517 @@ PROPERTIES = {
 PARENT = dict(flatten([[(child, prop) for child in children] for
 		prop,(inherited,default,children) in PROPERTIES.items()]))
 
-class CSSRefactor:
+class CSSRefactor(object):
+	# why aggressive() stopped: nothing left worth extracting, or which
+	# of its limits it hit
+	STOPPED = ('done', 'steps', 'time', 'saving', 'pool')
+	# hold sets of decl ids as int bitmasks rather than frozensets; the
+	# pairwise overlap pass is then a single big-int AND per pair
+	Compact = True
+	# at least this many rules, find and score the initial overlaps with
+	# a NumPy incidence matrix (see incidence.py), if NumPy is installed
+	MatrixRules = 500
+	# where aggressive() gets its initial candidate subsets: 'pairs',
+	# every intersection of two rules, 'itemsets', the closures of
+	# frequent itemsets of up to ItemsetSize decls (see itemsets()), or
+	# 'approx', intersections of just the rules MinHash over Bands x
+	# BandRows hashes finds at least Similarity alike (see approx())
+	CANDIDATES = ('pairs', 'itemsets', 'approx')
+	Candidates = 'pairs'
+	ItemsetSize = 3
+	Bands = 20
+	BandRows = 3
+	Crowd = 50
+	Similarity = 0.3
 	def __init__(self, doc):
 		self.doc = doc
+		self.interned = doc.interned
 		# merge all properies associated with each selector
-		sels_merged = CSSRefactor.selectors_merge(doc)
+		with stats.timer('refactor.selectors_merge'):
+			sels_merged = CSSRefactor.selectors_merge(doc)
 		# merge child properties into parents
 		foo = []
 		for sel, decls in sels_merged.items():
-			dcomb = CSSRefactor.decls_property_combine(decls)
-			dcomb2 = CSSRefactor.decls_values_combine(dcomb)
+			with stats.timer('refactor.decls_property_combine'):
+				dcomb = CSSRefactor.decls_property_combine(decls)
+			with stats.timer('refactor.decls_values_combine'):
+				dcomb2 = CSSRefactor.decls_values_combine(dcomb)
 			foo.append((sel, dcomb2))
 
 		# merge selectors having identical decls
-		identical_decls = defaultdict(list)
-		for s, d in foo:
-			identical_decls[d].append(s)
-		identical_decls = dict((d, sorted(s))
-			for d, s in identical_decls.items())
+		with stats.timer('refactor.identical_decls'):
+			identical_decls = defaultdict(list)
+			for s, d in foo:
+				identical_decls[d].append(s)
+			identical_decls = dict((d, sorted(s, key=lambda x:x.key))
+				for d, s in identical_decls.items())
 
 		self.rules = []
-		for d, s in sorted(identical_decls.items(), \
-				key=lambda x:x[1], \
-				cmp=lambda x,y: css_strcmp(x[0].format(), y[0].format())):
-			# eliminate identical decls and sort
-			d.decl = sorted(list(set(d.decl)), \
-				cmp=lambda x,y: css_strcmp(x.property, y.property))
-			#print s, d
-			r = Rule(Sels(s), d)
-			self.rules.append(r)
-
-	def format(self):
-		s = ''
-		for at in self.doc.atrules:
-			s += at.format()
-		for r in self.rules:
-			if r.decls.decl:
-				s += r.format()
-		return s.rstrip()
+		with stats.timer('refactor.sort'):
+			for d, s in sorted(identical_decls.items(), \
+					key=lambda x: css_sortkey(x[1][0].format(CANONICAL))):
+				# eliminate identical decls and sort
+				d.decl = sorted(unique(map(self.interned.decl, d.decl)), \
+					key=lambda x: css_sortkey(x.property))
+				#print s, d
+				r = Rule(Sels(s), d)
+				self.rules.append(r)
+		with stats.timer('refactor.index'):
+			self.reindex()
+		if stats.Enabled:
+			stats.count('refactor.selectors', len(sels_merged))
+			stats.count('refactor.rules', len(self.rules))
+			stats.count('refactor.decls', sum(len(r.decls.decl) for r in self.rules))
+		memory.checkpoint('refactor')
 
-	def aggressive(self, yield_step=False, step_max=100):
-		step = 1
-		while step <= step_max and self.extract_overlapping_decl_subsets():
-			if yield_step:
-				yield step
-			step += 1
-
-	def extract_overlapping_decl_subsets(self):
+	@staticmethod
+	def part(rules, interned):
+		"""
+		a CSSRefactor of just rules, which are already refactored;
+		it works on copies, so rules themselves are left alone
+		"""
+		ref = CSSRefactor.__new__(CSSRefactor)
+		ref.doc = None
+		ref.interned = interned
+		ref.rules = [Rule(r.sels, Decls(r.decls.decl)) for r in rules]
+		ref.reindex()
+		return ref
+
+	def reindex(self):
+		"""build what aggressive() keeps about self.rules"""
+		self.index = CSSRefactor.decl_index(self.rules)
+		# each rule's idset(), and its place in self.rules for sorting
+		self.ids = dict((r, self.idset(r)) for r in self.rules)
+		self.position = dict((r, n) for n, r in enumerate(self.rules))
+		# (idset, rules, new rule) for each extract(), in order
+		self.history = []
+		# rules by MinHash signature, once approx() wants it
+		self.lsh = None
+
+	def format(self, opts=None):
+		opts = opts or cssparse.Format.current()
+		stats.sample('format.stack_depth', len(cssparse.Format.Stack))
+		with stats.timer('format'):
+			s = ''
+			for at in self.doc.atrules:
+				s += at.format(opts)
+			for r in self.rules:
+				if r.decls.decl:
+					s += r.format(opts)
+			return s.rstrip()
+
+	def aggressive(self, yield_step=False, step_max=None,
+			time_max=None, min_saving=1, pool_max=None, jobs=None):
 		"""
 		aggressive optimization (expensive, i.e. slow)
 		for all declaration subsets shared by two or more selectors:
 			break them out into a separate rule if it will save space when minimized
-		"""
 
-		rules = [(set(r.decls.decl), r) for r in self.rules]
-		overlap = set([tuple(o) for o in
-				(xs & ys for (xs,_),(ys,_) in combinations(rules, 2)) if o])
-		if not overlap:
+		subsets are kept in a max-heap by the space they save and applied
+		best first, one per step. A step changes the saving of just the
+		subsets that share decls with it and sat in a rule it came out
+		of, which may go up as well as down (a rule with long selectors
+		leaving one), so those are rescored there and then and the top
+		of the heap is always the best subset held; subsets of the rules
+		a step changed are new and are scored too. A subset that saves
+		nothing is held, in case it comes to, while two or more rules
+		share it
+
+		stops early, leaving the rules as optimized so far, after
+		step_max steps, time_max seconds, when the best step left saves
+		fewer than min_saving bytes or when more than pool_max candidate
+		subsets would be held; a search for candidates cut
+		short by either limit stops it too, rather than going on with
+		some missing. Afterwards self.stopped says which of STOPPED
+		applied and self.estimated the sum of the steps'
+		overlap_score()s: an estimate, often well over the bytes the
+		minified output actually shrinks by
+
+		given jobs, the rules are split into groups that share no decls
+		and optimized a group at a time in that many processes (all
+		cores if 0); the limits then apply to each group
+		"""
+		if jobs is not None:
+			for step in self.aggressive_parts(jobs, step_max=step_max,
+					time_max=time_max, min_saving=min_saving,
+					pool_max=pool_max):
+				if yield_step:
+					yield step
+			return
+		self.stopped, self.estimated = None, 0
+		deadline = time() + time_max if time_max is not None else None
+		heap = []
+		# every candidate two or more rules share, and those holding each
+		# decl id, to find what a step changes; the pool is len(held)
+		held = set()
+		holding = defaultdict(set)
+		# each candidate's newest heap entry, by epoch; older entries for
+		# it are dead and skipped
+		live = {}
+		# why a search or push was cut short, if one was
+		cut = []
+		def limit(pool):
+			if deadline is not None and time() > deadline:
+				return 'time'
+			if pool_max is not None and pool > pool_max:
+				return 'pool'
 			return None
+		def stop(pool):
+			why = limit(pool)
+			if why:
+				cut.append(why)
+			return why
+		def hold(k, keep):
+			# a subset fewer than two rules share never comes back: only an
+			# extracted rule gains decls, and those were shared already
+			if keep == (k in held):
+				return
+			if keep:
+				held.add(k)
+				for i in self.members(k):
+					holding[i].add(k)
+			else:
+				held.discard(k)
+				for i in self.members(k):
+					holding[i].discard(k)
+		def push(overlaps, epoch):
+			for n, k in enumerate(overlaps):
+				if not n % 1024 and stop(len(held)):
+					return
+				score, rules = self.overlap_score(k)
+				hold(k, len(rules) > 1)
+				if score > 0:
+					live[k] = epoch
+					heappush(heap, (-score, self.rank(k), epoch, k))
+				else:
+					live.pop(k, None)
+		epoch = 0
+		approx = CSSRefactor.Candidates == 'approx'
+		with stats.timer('aggressive.initial'):
+			# the matrix is as big as the sheet approx is for
+			matrix = None if approx else self.matrix()
+			# nothing is live yet, so what a search has found is the pool
+			if approx:
+				overlaps = self.approx(stop=stop)
+			elif CSSRefactor.Candidates == 'itemsets':
+				overlaps = list(self.itemsets(min_saving, stop=stop))
+			elif matrix:
+				overlaps = matrix.overlaps(stop=stop)
+			else:
+				overlaps = self.overlaps(stop=stop)
+			stats.count('aggressive.initial_candidates', len(overlaps))
+			if matrix:
+				# each is two rules' shared decls, so held
+				for k, score in zip(overlaps, matrix.scores(overlaps)):
+					hold(k, True)
+					if score > 0:
+						live[k] = epoch
+						heappush(heap, (-score, self.rank(k), epoch, k))
+			else:
+				push(overlaps, epoch)
+		memory.checkpoint('aggressive.initial')
+		step = 1
+		while True:
+			self.stopped = cut[0] if cut else limit(len(held))
+			if self.stopped:
+				break
+			if not heap:
+				self.stopped = 'done'
+				break
+			if step_max is not None and step > step_max:
+				self.stopped = 'steps'
+				break
+			_, _, at, k = heappop(heap)
+			if live.get(k) != at:
+				continue # dead
+			del live[k]
+			score, rules = self.overlap_score(k)
+			if score < min_saving:
+				# the best there is, so nothing else is worth it either
+				self.stopped = 'saving'
+				break
+			before = [self.ids[r] for r in rules]
+			with stats.timer('aggressive.extract'):
+				extracted = self.extract(k, rules)
+			self.estimated += score
+			epoch += 1
+			changed = list(rules) + [extracted]
+			# what a step's search finds is mostly held already, so only
+			# the pool as it stands counts against pool_max until pushed
+			search = lambda n: stop(len(held))
+			with stats.timer('aggressive.step_candidates'):
+				affected = set(c for i in self.members(k) for c in holding[i]
+					if any(c & ids == c for ids in before))
+				stats.count('aggressive.rescored', len(affected))
+				overlaps = self.approx(changed, search) if approx else \
+					self.overlaps(changed, search)
+				push(affected.union(overlaps), epoch)
+			stats.sample('aggressive.step_candidates', len(overlaps))
+			stats.sample('aggressive.step_estimated', score)
+			stats.sample('aggressive.heap', len(heap))
+			stats.sample('aggressive.pool', len(held))
+			memory.checkpoint('aggressive.step', objects=False)
+			if yield_step:
+				yield step
+			step += 1
+		memory.checkpoint('aggressive')
 
+	def overlaps(self, changed=None, stop=None):
 		"""
-		# try to reduce number of least effective overlaps considered in each round
-		# this hueristic reduces effectiveness ~10% but halves execution time
-		maxoverlap = len(max(overlap, key=len))
-		print >> sys.stderr, 'maxoverlap:', maxoverlap
-		if maxoverlap > 2:
-			overlap = [o for o in overlap if len(o) >= 2]
-		print >> sys.stderr, 'rules(%u) * overlap(%u): %u' % (
-			len(rules), len(overlap),
-			len(rules) * len(overlap))
+		declaration subsets shared by two or more rules, as sets of decl
+		ids (see idset()); if changed is given, only those involving its rules.
+		stop(n) is checked as the n subsets so far are collected and the
+		search ends early if it returns true
 		"""
+		if changed is None:
+			ids = [self.ids[r] for r in self.rules]
+			overlap = set()
+			for n, xs in enumerate(ids):
+				overlap.update([o for o in
+					(xs & ys for ys in islice(ids, n+1, None)) if o])
+				if stop and stop(len(overlap)):
+					break
+			return overlap
+		# only rules sharing a decl with a changed one can overlap it
+		ids = self.ids
+		index = self.index
+		overlap = set()
+		for r in changed:
+			xs = ids[r]
+			partners = set(chain.from_iterable(index[i] for i in self.members(xs)))
+			partners.discard(r)
+			overlap.update([xs & ids[y] for y in partners])
+			if stop and stop(len(overlap)):
+				break
+		return overlap
+
+	def approx(self, changed=None, stop=None):
+		"""
+		as overlaps(), but only the subsets shared by rules that LSH
+		buckets together and that are at least Similarity alike by
+		Jaccard measure (decls shared over decls in either). For large
+		sheets far fewer pairs of rules than overlaps() tries, at the
+		cost of missing some subsets; more Bands miss fewer. Buckets of
+		over Crowd rules are passed over (see LSH.near())
+		"""
+		ids = self.ids
+		lsh = self.lsh
+		if lsh is None:
+			lsh = self.lsh = LSH(CSSRefactor.Bands, CSSRefactor.BandRows,
+				CSSRefactor.Crowd)
+			for r in self.rules:
+				lsh.add(r, [d.id for d in r.decls.decl])
+		position = self.position
+		similarity = CSSRefactor.Similarity
+		overlap = set()
+		for r in self.rules if changed is None else changed:
+			xs = ids[r]
+			n = len(r.decls.decl)
+			for y in lsh.near(r):
+				# each pair once, unless changed
+				if changed is None and position[y] < position[r]:
+					continue
+				o = xs & ids[y]
+				if not o:
+					continue
+				# decls are unique, so the union is the rest
+				shared = self.count(o)
+				if shared >= similarity * (n + len(y.decls.decl) - shared):
+					overlap.add(o)
+			if stop and stop(len(overlap)):
+				break
+		return overlap
+
+	def itemsets(self, min_saving=1, stop=None):
+		"""
+		declaration subsets that close a frequent itemset: all the decls
+		common to the rules containing it. With the same rules and more
+		decls a closure always saves more than the itemset, so only
+		closures are kept; they include subsets that are no two rules'
+		exact intersection. stop is as for overlaps()
+		"""
+		byid = self.interned.byid
+		ids = self.ids
+		index = self.index
+		minsel = min([len(r.sels) for r in self.rules] or [0])
+		def prune(itemset, support):
+			# decls in 2+ of its rules bound what any extension's
+			# closure can hold; give up if even that can't pay
+			counts = defaultdict(int)
+			for r in CSSRefactor.index_lookup(index, itemset):
+				for d in r.decls.decl:
+					counts[d.id] += 1
+			most = sum(len(byid[i]) for i, n in counts.iteritems() if n > 1)
+			return (most - minsel) * support < min_saving
+		found = set()
+		for itemset, _ in fpgrowth([self.members(ids[r]) for r in self.rules],
+				2, CSSRefactor.ItemsetSize, prune):
+			rules = CSSRefactor.index_lookup(index, itemset)
+			found.add(reduce(lambda x, y: x & y, [ids[r] for r in rules]))
+			if stop and stop(len(found)):
+				break
+		return found
+
+	def overlap_score(self, shared):
+		"""
+		(estimated bytes saved by extracting shared, the rules it comes out of);
+		the difference between sum total lengths of decls - selectors
+		"""
+		shared = self.members(shared)
+		rules = CSSRefactor.index_lookup(self.index, shared)
+		if len(rules) < 2:
+			return (0, rules)
+		byid = self.interned.byid
+		sharedlen = sum(len(byid[i]) for i in shared) * len(rules)
+		sellen = sum([len(r.sels) for r in rules])
+		return (sharedlen - sellen, rules)
+
+	def extract(self, shared, rules):
+		"""
+		move the decls in shared out of rules and into a new rule for
+		all of their selectors; returns the new rule
+		"""
+		byid = self.interned.byid
+		index = self.index
+		idset = shared
+		shared = frozenset(self.members(shared))
+		# ordered as CSSRefactor() orders them rather than by hash
+		rules = sorted(rules, key=self.position.get)
+		extracted = Rule(Sels([r.sels for r in rules]),
+				Decls(sorted((byid[i] for i in shared),
+					key=lambda x: css_sortkey(x.property))))
+		# remove shared subsets from the originals
+		for r in rules:
+			r.decls.decl = [d for d in r.decls.decl
+						if d.id not in shared]
+		for i in shared:
+			index[i].difference_update(rules)
+			index[i].add(extracted)
+		for r in rules:
+			self.ids[r] = self.idset(r)
+		self.ids[extracted] = self.idset(extracted)
+		if self.lsh is not None:
+			for r in rules + [extracted]:
+				self.lsh.add(r, [d.id for d in r.decls.decl])
+		self.rules.insert(0, extracted)
+		self.position[extracted] = -len(self.rules)
+		self.history.append((idset, rules, extracted))
+		return extracted
+
+	def components(self):
+		"""
+		self.rules in groups that share no decls with each other, so
+		can't affect each other's extractions; groups of one are left
+		out, as nothing can be extracted from them
+		"""
+		group = dict((r, r) for r in self.rules)
+		def find(r):
+			while group[r] is not r:
+				group[r] = group[group[r]]
+				r = group[r]
+			return r
+		for rules in self.index.itervalues():
+			rules = list(rules)
+			for r in rules[1:]:
+				group[find(r)] = find(rules[0])
+		groups = defaultdict(list)
+		for r in self.rules:
+			groups[find(r)].append(r)
+		return sorted((g for g in groups.itervalues() if len(g) > 1),
+				key=lambda g: self.position[g[0]])
 
-		# for each overlapping subset, set of all decls that contain it
-		# O(n^2)... slow!
-		overlap_decls_sets = [(set(o), o) for o in overlap]
-		tmp = {}
-		for rs, r in rules:
-			for ks, k in overlap_decls_sets:
-				if ((ks & rs) == ks):
-					try:
-						tmp[k][r] = 1
-					except KeyError:
-						tmp[k] = {r:1}
-		overlap_decls_total = tmp
-
-		# calculate difference between sum total lengths of decls - selectors
-		for shared, rules in overlap_decls_total.items():
-			sharedlen = sum(map(len, shared)) * len(rules)
-			sellen = sum([len(r.sels) for r in rules.keys()])
-			overlap_decls_total[shared] = (sharedlen - sellen, rules)
-
-		# sort the overlapping subsets by the difference between the length of the decls
-		# and the selectors; this is the space that we can save by applying it
-		worth_it = list(filter(lambda x:x[1][0] > 0,
-					overlap_decls_total.items()))
-		if not worth_it:
+	def aggressive_parts(self, jobs, **limits):
+		"""
+		aggressive() on each of components() in a pool of jobs processes;
+		each returns the extractions it made, which are then applied
+		here in order, so the result doesn't depend on jobs
+		"""
+		parts = self.components()
+		if 'time_max' in limits and limits['time_max'] is not None:
+			limits['deadline'] = time() + limits.pop('time_max')
+		self.stopped, self.estimated = 'done', 0
+		init = (self.interned, parts, limits)
+		pool = None
+		if jobs == 1 or len(parts) < 2:
+			_part_init(*init)
+			plans = (_part_run(n) for n in xrange(len(parts)))
+		else:
+			import multiprocessing
+			pool = multiprocessing.Pool(jobs or None, _part_init, init)
+			plans = pool.imap(_part_run, xrange(len(parts)))
+		try:
+			step = 1
+			for rules, (plan, stopped, estimated) in izip(parts, plans):
+				if stopped != 'done':
+					self.stopped = stopped
+				self.estimated += estimated
+				rules = list(rules)
+				for idset, which in plan:
+					rules.append(self.extract(idset, [rules[n] for n in which]))
+					yield step
+					step += 1
+		finally:
+			# also when a part raised or the caller stopped early, which
+			# would otherwise leave the processes running
+			if pool is not None:
+				pool.terminate()
+				pool.join()
+
+	def matrix(self):
+		"""an incidence.Incidence of self.rules, if it's worth having"""
+		global incidence
+		if not CSSRefactor.Compact or \
+				len(self.rules) < CSSRefactor.MatrixRules:
 			return None
-
-		best = sorted(worth_it, key=lambda x:x[1][0], reverse=True)
-
-		bestdecls, (bestscore, bestrules) = best[0]
-		if bestscore < 1 or not bestrules:
-			# no more space-saving overlaps
+		if incidence is None:
+			try:
+				import incidence
+			except ImportError:
+				incidence = False
+		if not incidence:
 			return None
+		return incidence.Incidence([self.ids[r] for r in self.rules],
+			map(len, self.interned.byid),
+			[len(r.sels) for r in self.rules])
 
-		# apply as many space-saving overlap extractions as possible
-		affected = set()
-		for bestdecls, (bestscore, bestrules) in best:
+	def idset(self, rule):
+		"""the set of a rule's decl ids, as Compact says"""
+		ids = (d.id for d in rule.decls.decl)
+		return bitmask(ids) if CSSRefactor.Compact else frozenset(ids)
 
-			# if we hit an entry that refers to a selector that
-			# appeared in a previous entry we need to stop, because
-			# it affects the results
-			for r in bestrules:
-				for sel in r.sels.sel:
-					if sel in affected:
-						return True
-					affected.add(sel)
+	def rank(self, idset):
+		"""orders idsets of equal saving, so ties break the same way
+		whatever order sets of rules happen to iterate in"""
+		return idset if CSSRefactor.Compact else sorted(idset)
 
-			# build a new rule for bestrules/bestdecls
-			extracted = Rule(Sels([r.sels for r in bestrules]),
-					Decls(bestdecls))
+	def count(self, idset):
+		"""the number of decl ids in an idset()"""
+		return bin(idset).count('1') if CSSRefactor.Compact else len(idset)
 
-			# remove shared subsets from the originals
-			for r in bestrules:
-				for d in bestdecls:
-					try:
-						r.decls.decl.remove(d)
-					except ValueError:
-						pass
-	
-			self.rules.insert(0, extracted)
+	def members(self, idset):
+		"""the decl ids in an idset()"""
+		return bits(idset) if CSSRefactor.Compact else idset
 
-		return True
+	@staticmethod
+	def decl_index(rules):
+		"""map each interned decl id to the set of rules containing it"""
+		index = defaultdict(set)
+		for r in rules:
+			for d in r.decls.decl:
+				index[d.id].add(r)
+		return index
+
+	@staticmethod
+	def index_lookup(index, ids):
+		"""the rules containing every decl in ids, intersecting the
+		smallest posting lists first"""
+		postings = sorted((index[i] for i in ids), key=len)
+		found = set(postings[0])
+		for p in postings[1:]:
+			if not found:
+				break
+			found &= p
+		return found
 
 
 	@staticmethod
@@ -361,12 +772,14 @@ class CSSRefactor:
 	@staticmethod
 	def decls_values_combine(block):
 		"""any list of box-model values can potentially be optimized"""
-		for decl in block.decl:
+		for i, decl in enumerate(block.decl):
 			if decl.property in PROPERTIES:
 				_, merger, _ = PROPERTIES[decl.property]
 				vals = CSSRefactor.vals_merge(merger, decl.values)
 				if vals != decl.values:
-					decl.values = vals
+					# decls may be interned; replace, don't modify
+					block.decl[i] = Decl(decl.property, vals,
+						decl.post_prop_s, decl.pre_vals_s)
 		return block
 
 	@staticmethod
@@ -434,3 +847,29 @@ class CSSRefactor:
 			if len(d) != len(decls):
 				yield (r, len(decls) - len(d))
 
+# what _part_run() works on in each process of aggressive_parts()
+_part = None
+
+def _part_init(interned, parts, limits):
+	global _part
+	_part = (interned, parts, limits)
+
+def _part_run(n):
+	"""
+	aggressive() on part n; returns the extractions made as (idset, the
+	positions of their rules in the part, with new rules numbered on),
+	and why it stopped and its estimated saving
+	"""
+	interned, parts, limits = _part
+	limits = dict(limits)
+	if 'deadline' in limits:
+		limits['time_max'] = max(0, limits.pop('deadline') - time())
+	ref = CSSRefactor.part(parts[n], interned)
+	handle = dict((r, n) for n, r in enumerate(ref.rules))
+	for _ in ref.aggressive(**limits):
+		pass
+	plan = []
+	for idset, rules, extracted in ref.history:
+		plan.append((idset, [handle[r] for r in rules]))
+		handle[extracted] = len(handle)
+	return plan, ref.stopped, ref.estimated
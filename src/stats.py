@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Named timers and counters, for --stats
+
+Off until enable(); until then timer() hands out one shared context
+manager that does nothing and count() and sample() return at once, so
+the calls left in parse.py and refactor.py cost next to nothing. Once
+on, each name collects:
+
+	timer(name)		calls and total seconds of the with-block
+	count(name, n)		a running total
+	sample(name, x)		how many, total, min and max of x, e.g. per step
+
+add_options() and setup() give each CLI --stats, --profile and
+--mem-report.
+
+Copyright 2011 Ryan Flynn <parseerror@gmail.com>
+MIT licensed: http://www.opensource.org/licenses/mit-license.php
+"""
+
+import sys
+import json
+from time import time
+
+Enabled = False
+# name -> [calls, seconds]
+Timers = {}
+# name -> total
+Counters = {}
+# name -> [n, total, min, max]
+Samples = {}
+
+class _Off(object):
+	"""timer() while disabled"""
+	def __enter__(self): pass
+	def __exit__(self, *exc): pass
+
+_OFF = _Off()
+
+class _Timer(object):
+	def __init__(self, name):
+		self.name = name
+	def __enter__(self):
+		self.start = time()
+	def __exit__(self, *exc):
+		t = Timers.get(self.name)
+		if t is None:
+			t = Timers[self.name] = [0, 0.0]
+		t[0] += 1
+		t[1] += time() - self.start
+
+def enable(on=True):
+	global Enabled
+	Enabled = on
+
+def reset():
+	Timers.clear()
+	Counters.clear()
+	Samples.clear()
+
+def timer(name):
+	"""with timer(name): ..."""
+	return _Timer(name) if Enabled else _OFF
+
+def count(name, n=1):
+	if Enabled:
+		Counters[name] = Counters.get(name, 0) + n
+
+def sample(name, x):
+	if Enabled:
+		s = Samples.get(name)
+		if s is None:
+			Samples[name] = [1, x, x, x]
+		else:
+			s[0] += 1
+			s[1] += x
+			if x < s[2]:
+				s[2] = x
+			if x > s[3]:
+				s[3] = x
+
+def report(out, form='text'):
+	"""write what was collected to out, as text or json"""
+	if form == 'json':
+		out.write(json.dumps({
+			'timers': dict((k, {'calls': n, 'seconds': round(s, 6)})
+				for k, (n, s) in Timers.iteritems()),
+			'counters': Counters,
+			'samples': dict((k, {'n': n, 'total': t, 'min': lo, 'max': hi})
+				for k, (n, t, lo, hi) in Samples.iteritems()),
+		}, indent=1, sort_keys=True) + '\n')
+		return
+	if Timers:
+		print >> out, '%-36s %8s %10s' % ('timer', 'calls', 'seconds')
+		for k in sorted(Timers):
+			print >> out, '%-36s %8u %10.4f' % (k, Timers[k][0], Timers[k][1])
+	if Counters:
+		print >> out, '%-36s %8s' % ('counter', 'total')
+		for k in sorted(Counters):
+			print >> out, '%-36s %8u' % (k, Counters[k])
+	if Samples:
+		print >> out, '%-36s %8s %10s %8s %8s %10s' % (
+			'sample', 'n', 'total', 'min', 'max', 'mean')
+		for k in sorted(Samples):
+			n, t, lo, hi = Samples[k]
+			print >> out, '%-36s %8u %10u %8u %8u %10.1f' % (
+				k, n, t, lo, hi, float(t) / n)
+
+def add_options(op, jobs=False):
+	"""
+	--stats, --profile and --mem-report and their forms, for each CLI;
+	jobs says it has --jobs, whose workers none of them count
+	"""
+	workers = lambda sep: sep + ' not counting --jobs workers' if jobs else ''
+	op.add_option('--stats', dest='stats', action='store_true', help='print timers and counters to stderr when done' + workers(','))
+	op.add_option('--stats-format', dest='stats_format', default='text', type='choice', choices=('text', 'json'), metavar='FORM', help='with --stats, text (default) or json')
+	op.add_option('--profile', dest='profile', metavar='PATH', help='profile the run into PATH, for pstats, and PATH.folded, collapsed stacks for flame graphs' + workers(';'))
+	op.add_option('--profile-mode', dest='profile_mode', default='trace', type='choice', choices=('trace', 'sample'), metavar='MODE', help='with --profile, trace (default) every call, or sample the stack every --profile-sample of CPU, so long runs keep their timing')
+	op.add_option('--profile-sample', dest='profile_sample', type='float', default=5, metavar='MS', help='with --profile-mode=sample, milliseconds between samples (default %default)')
+	op.add_option('--mem-report', dest='mem_report', action='store_true', help='print resident memory and the types of object that grew, by phase, to stderr when done' + workers(','))
+	op.add_option('--mem-report-format', dest='mem_report_format', default='text', type='choice', choices=('text', 'json'), metavar='FORM', help='with --mem-report, text (default) or json')
+
+def setup(opts, out=None):
+	"""start what add_options()' opts ask for, reporting to out (stderr)
+	at exit"""
+	import atexit
+	out = out or sys.stderr
+	if opts.stats:
+		enable()
+		atexit.register(report, out, opts.stats_format)
+	if opts.profile:
+		import profiling
+		atexit.register(profiling.start(opts.profile,
+			opts.profile_sample / 1000.0 if opts.profile_mode == 'sample' else None).stop)
+	if opts.mem_report:
+		import memory
+		memory.enable()
+		atexit.register(memory.report, out, opts.mem_report_format)
@@ -6,12 +6,28 @@ Base unit test object for css-tools
 """
 
 import os
+import sys
+import subprocess
+from time import time
+from StringIO import StringIO
 
 import parse as cssparse
 import refactor as cssrefactor
+import minify
 
 class CSSUnitTests:
 	PATH = '../test/'
+	# other ways to run aggressive(), each of which must give what the
+	# default does: (name, CSSRefactor settings, aggressive() arguments)
+	AGGRESSIVE = [
+		('jobs=1', {}, {'jobs': 1}),
+		('jobs=2', {}, {'jobs': 2}),
+		# the same as the default where NumPy isn't installed
+		('NumPy', {'MatrixRules': 0}, {}),
+		('frozensets', {'Compact': False}, {}),
+		('itemsets', {'Candidates': 'itemsets'}, {}),
+		('approx', {'Candidates': 'approx'}, {}),
+	]
 	def __init__(self, testdir):
 		self.testdir = testdir
 		self.tests = []
@@ -31,27 +47,71 @@ class CSSUnitTests:
 			# handle "after" options
 			do_minify =  afteropts.find('minify') > -1
 			do_aggressive =  afteropts.find('aggressive') > -1
-			doc = cssparse.CSSDoc.parse(before)
+			if not CSSUnitTests.parsers_agree(before):
+				print '!! parse engines disagree'
+				continue
+			doc = cssparse.CSSDoc.parse(before, lean=True)
 			if self.testdir == 'refactor':
 				ref = cssrefactor.CSSRefactor(doc)
 				if do_aggressive:
 					for _ in ref.aggressive(yield_step=True, step_max=100):
 						pass
-				doc = cssparse.CSSDoc.parse(ref.format())
-			if do_minify:
-				cssparse.Format.minify()
-			else:
-				cssparse.Format.canonical()
-			result = doc.format()
+				refactored = ref.format(cssparse.CANONICAL)
+				if do_aggressive:
+					differ = [name for name, settings, args in CSSUnitTests.AGGRESSIVE
+						if CSSUnitTests.aggressive(before, settings, args) != refactored]
+					if differ:
+						print '!! aggressive() with %s gave different output' % (
+							', '.join(differ),)
+						continue
+				doc = cssparse.CSSDoc.parse(refactored, lean=True)
+			opts = cssparse.MINIFY if do_minify else cssparse.CANONICAL
+			result = doc.format(opts)
+			if self.testdir != 'refactor':
+				# small chunks exercise the rule boundary scanner
+				items = cssparse.CSSDoc.iterparse(StringIO(before), chunksize=7)
+				streamed = ''.join(cssparse.CSSDoc.format_stream(items, opts))
+				if streamed != result:
+					print '!! streaming gave "%s", not "%s"' % (streamed, result)
+					continue
+				if do_minify:
+					out = StringIO()
+					minify.minify(before, out)
+					if out.getvalue() != result:
+						print '!! minifier gave "%s", not "%s"' % (out.getvalue(), result)
+						continue
 			if result == after:
 				print 'OK'
 				passed += 1
 			else:
 				print '!! expected "%s", got "%s"' % (after, result)
-		cssparse.Format.pop()
 		print '%u/%u tests passed%s' % (passed, len(self.tests),
 			', %u skipped' % len(self.skipped) if self.skipped else '')
 
+	@staticmethod
+	def aggressive(text, settings, args):
+		"""text refactored by aggressive(**args) with the CSSRefactor
+		class attributes in settings, which are then put back"""
+		CSSRefactor = cssrefactor.CSSRefactor
+		saved = dict((k, getattr(CSSRefactor, k)) for k in settings)
+		try:
+			for k, v in settings.iteritems():
+				setattr(CSSRefactor, k, v)
+			ref = CSSRefactor(cssparse.CSSDoc.parse(text, lean=True))
+			for _ in ref.aggressive(step_max=100, **args):
+				pass
+			return ref.format(cssparse.CANONICAL)
+		finally:
+			for k, v in saved.iteritems():
+				setattr(CSSRefactor, k, v)
+
+	@staticmethod
+	def parsers_agree(text):
+		"""every parse engine must produce the same tree"""
+		trees = [p.parse(text, production='css')
+				for p in cssparse.CSSDoc.Parsers.values()]
+		return all(t == trees[0] for t in trees)
+
 	@staticmethod
 	def parse_test(filename):
 		try:
@@ -71,6 +131,55 @@ class CSSUnitTests:
 			print 'test "%s" is fucked up. fix it!' % (filename,)
 			exit(1)
 
+def lsh_tests():
+	"""(name, passed) for each check of minhash.LSH"""
+	from minhash import LSH
+	lsh = LSH(bands=4, rows=2)
+	lsh.add('a', [1, 2, 3])
+	lsh.add('b', [1, 2, 3])
+	found = lsh.near('a')
+	# 'a' again, with items it can't share a bucket with 'b' by
+	lsh.add('a', [7, 8, 9])
+	yield 'equal sets are near', found == set(['b'])
+	yield 're-adding a key replaces its buckets', 'a' not in lsh.near('b') and \
+		sorted(b for b, keys in lsh.buckets.iteritems() if 'a' in keys) == \
+		sorted(lsh.keys['a'])
+	lsh.remove('a')
+	yield 'removing a key empties its buckets', 'a' not in lsh.keys and \
+		all(keys for keys in lsh.buckets.itervalues()) and \
+		not any('a' in keys for keys in lsh.buckets.itervalues())
+	def crowded(crowd):
+		lsh = LSH(bands=4, rows=2, crowd=crowd)
+		for k in 'xyz':
+			lsh.add(k, [4, 5, 6])
+		return lsh.near('x')
+	yield 'near() skips buckets over crowd', crowded(2) == set()
+	yield 'near() keeps buckets of crowd', crowded(3) == set('yz')
+	sig = lambda seed: LSH(seed=seed).signature([10, 20, 30])
+	yield 'the same seed gives the same signature', sig(5) == sig(5)
+	yield 'another seed gives another signature', sig(5) != sig(6)
+
+# ms css-format.py may take to start up and format empty input, beyond
+# what the interpreter alone takes; editor and commit hooks run it on
+# every save
+COLD_START_MS = 40
+
+def cold_start(runs=5):
+	"""
+	(ms css-format.py takes on empty input, ms the interpreter takes
+	to do nothing), the best of runs of each
+	"""
+	def best(args):
+		times = []
+		for _ in xrange(runs):
+			start = time()
+			p = subprocess.Popen([sys.executable] + args,
+				stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+			p.communicate('')
+			times.append(time() - start)
+		return min(times) * 1000
+	return best(['css-format.py']), best(['-c', 'pass'])
+
 if __name__ == '__main__':
 	# run unit tests
 	for root, dirs, files in os.walk(CSSUnitTests.PATH):
@@ -78,3 +187,15 @@ if __name__ == '__main__':
 			print '%s...' % (d,)
 			t = CSSUnitTests(d)
 			t.test()
+	print 'minhash...'
+	results = list(lsh_tests())
+	for name, ok in results:
+		print name, 'OK' if ok else '!! failed'
+	print '%u/%u tests passed' % (sum(ok for _, ok in results), len(results))
+	ms, python = cold_start()
+	print 'cold start: %.0fms, %.0fms over the interpreter (target %ums)' % (
+		ms, ms - python, COLD_START_MS),
+	if ms - python > COLD_START_MS:
+		print '!! too slow'
+		exit(1)
+	print 'OK'